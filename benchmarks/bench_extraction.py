@@ -0,0 +1,50 @@
+"""
+Микро-бенчмарк извлечения текста: прежний разбор через BeautifulSoup
+против потокового extract_main_text_fast на сохраненных HTML-страницах.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_extraction.py [--repeat 20] [--limit 2000]
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from extraction import extract_main_text_fast, parse_main_text  # noqa: E402
+
+FIXTURES = Path(__file__).resolve().parent / 'fixtures'
+
+
+def best_time(func, repeat: int):
+    """
+    Возвращает минимальное время одного вызова func (в миллисекундах) из `repeat` запусков.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=20, help='сколько раз запускать каждый экстрактор')
+    parser.add_argument('--limit', type=int, default=2000, help='сколько символов текста нужно')
+    args = parser.parse_args()
+
+    print(f'{"fixture":<24}{"KB":>8}{"bs4, ms":>10}{"fast, ms":>10}{"speedup":>9}  same text')
+    for path in sorted(FIXTURES.glob('*.html')):
+        content = path.read_bytes()
+        legacy = parse_main_text(content)[:args.limit]
+        fast = extract_main_text_fast(content, args.limit)
+        legacy_ms = best_time(lambda: parse_main_text(content)[:args.limit], args.repeat)
+        fast_ms = best_time(lambda: extract_main_text_fast(content, args.limit), args.repeat)
+        print(
+            f'{path.name:<24}{len(content) / 1024:>8.0f}{legacy_ms:>10.2f}{fast_ms:>10.2f}'
+            f'{legacy_ms / fast_ms:>8.1f}x  {"yes" if legacy == fast else "no"}'
+        )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""
+Микро-бенчмарк отбора фрагментов: прежняя обрезка текста страницы до 2000 символов
+против лучших по BM25 фрагментов в пределах бюджета токенов на сохраненных HTML-страницах.
+
+Для каждой страницы выводится оценка числа токенов текста, доля слов вопроса,
+которые в этот текст попали, и время отбора фрагментов.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_passages.py [--query "..."] [--budget 300] [--repeat 20]
+"""
+import argparse
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bench_extraction import FIXTURES, best_time  # noqa: E402
+from extraction import extract_main_text_fast  # noqa: E402
+from passages import estimate_tokens, select_passages, tokenize  # noqa: E402
+
+DEFAULT_QUERY = 'В каком году основан университет ИТМО?\n1. 1900\n2. 1918\n3. 1930'
+
+
+def coverage(text: str, query: str):
+    """
+    Доля различных слов запроса, встречающихся в тексте.
+    """
+    terms = set(tokenize(query))
+    return len(terms & set(tokenize(text))) / len(terms) if terms else 0.0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--query', default=DEFAULT_QUERY, help='вопрос вместе с вариантами ответа')
+    parser.add_argument('--budget', type=int, default=300, help='бюджет токенов на источник')
+    parser.add_argument('--passage-chars', type=int, default=400, help='длина фрагмента')
+    parser.add_argument('--page-chars', type=int, default=20000, help='сколько символов текста страницы извлекать')
+    parser.add_argument('--repeat', type=int, default=20, help='сколько раз запускать отбор')
+    args = parser.parse_args()
+
+    print(f'{"fixture":<24}{"old tok":>9}{"old cov":>9}{"new tok":>9}{"new cov":>9}{"rank, ms":>10}')
+    for path in sorted(FIXTURES.glob('*.html')):
+        text = extract_main_text_fast(path.read_bytes(), args.page_chars)
+        old = text[:2000]
+        new = select_passages(text, args.query, args.budget, args.passage_chars)
+        rank_ms = best_time(lambda: select_passages(text, args.query, args.budget, args.passage_chars), args.repeat)
+        print(
+            f'{path.name:<24}{estimate_tokens(old):>9}{coverage(old, args.query):>9.2f}'
+            f'{estimate_tokens(new):>9}{coverage(new, args.query):>9.2f}{rank_ms:>10.2f}'
+        )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,292 @@
+"""
+Офлайн нагрузочный тест сервиса на локальных заглушках Yandex Search, Yandex GPT и веб-страниц.
+
+Скрипт поднимает заглушки (см. mock_services.py), запускает main:app через uvicorn
+с адресами API, указывающими на заглушки, и отправляет вопросы из JSONL-файла
+с заданной параллельностью. В конце печатает пропускную способность, перцентили
+задержки и время по этапам, а результат сохраняет в JSON для сравнения прогонов.
+
+Запуск из корня репозитория:
+    python benchmarks/load_test.py --concurrency 8 --repeat 3
+    python benchmarks/load_test.py --gpt-rps 5 --compare benchmarks/results/baseline.json
+    python benchmarks/load_test.py --env RELEVANCE_MODE=batch --name batch-relevance
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import aiohttp
+from prometheus_client.parser import text_string_to_metric_families
+
+BENCHMARKS = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCHMARKS))
+
+from mock_services import MockServices  # noqa: E402
+
+ROOT = BENCHMARKS.parent
+RESULTS = BENCHMARKS / 'results'
+
+
+def percentile(values, q: float):
+    """
+    Перцентиль q (от 0 до 100) с линейной интерполяцией; для пустого списка — 0.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def load_queries(path: Path, repeat: int):
+    """
+    Читает вопросы в формате JSONL ({"id": ..., "query": ...} на строку) и повторяет их `repeat` раз.
+    """
+    items = [json.loads(line) for line in path.read_text(encoding='utf-8').splitlines() if line.strip()]
+    return [
+        {'id': round_number * len(items) + index, 'query': item['query']}
+        for round_number in range(repeat)
+        for index, item in enumerate(items)
+    ]
+
+async def start_app(mocks: MockServices, env_overrides: dict, log_path: Path):
+    """
+    Запускает main:app в отдельном процессе uvicorn и ждет, пока он начнет отвечать.
+
+    Возвращает:
+        tuple: (процесс, базовый URL сервиса, открытый файл лога).
+    """
+    port = free_port()
+    env = {
+        **os.environ,
+        'FOLDER_ID': 'bench',
+        'YANDEXGPT_KEY': 'bench',
+        'YANDEX_SEARCH_KEY': 'bench',
+        'YANDEX_GPT_API_URL': f'{mocks.base_url}/gpt/completion',
+        'YANDEX_SEARCH_API_URL': f'{mocks.base_url}/search/xml',
+        **env_overrides,
+    }
+    log = open(log_path, 'w')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning'],
+        cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    async with aiohttp.ClientSession() as session:
+        for _ in range(300):
+            if process.poll() is not None:
+                raise RuntimeError(f'Сервис не запустился, см. {log_path}')
+            try:
+                async with session.get(f'{base_url}/api/cache/stats') as response:
+                    if response.status == 200:
+                        return process, base_url, log
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f'Сервис не ответил за 30 секунд, см. {log_path}')
+
+async def run_requests(base_url: str, items, concurrency: int):
+    """
+    Отправляет вопросы в /api/request, не больше `concurrency` одновременно.
+
+    Возвращает:
+        list of tuple: (задержка в секундах, успешен ли ответ, примененные деградации) по каждому вопросу.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    timeout = aiohttp.ClientTimeout(total=None)
+
+    async def send(session, item):
+        async with semaphore:
+            started = time.monotonic()
+            body = {}
+            try:
+                async with session.post(f'{base_url}/api/request', json=item) as response:
+                    body = await response.json()
+                    ok = response.status == 200 and 'answer' in body
+            except aiohttp.ClientError:
+                ok = False
+            return time.monotonic() - started, ok, body.get('degradations', [])
+
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        return await asyncio.gather(*(send(session, item) for item in items))
+
+async def run_batch(base_url: str, items):
+    """
+    Отправляет все вопросы одним запросом в /api/batch; задержка вопроса — время до прихода его строки.
+    """
+    results = []
+    started = time.monotonic()
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None)) as session:
+        async with session.post(f'{base_url}/api/batch', json=items) as response:
+            async for line in response.content:
+                if line.strip():
+                    body = json.loads(line)
+                    results.append((time.monotonic() - started, 'error' not in body, body.get('degradations', [])))
+    return results
+
+async def fetch_app_stages(base_url: str):
+    """
+    Снимает с /metrics сервиса суммарное время и число этапов и внешних вызовов.
+
+    Возвращает:
+        dict: "stage:<этап>" или "call:<сервис>" -> {"calls", "total", "mean"}.
+    """
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f'{base_url}/metrics') as response:
+            text = await response.text()
+    totals = {}
+    for family in text_string_to_metric_families(text):
+        if family.name not in ('ai_query_stage_seconds', 'ai_query_external_call_seconds'):
+            continue
+        for sample in family.samples:
+            if sample.name.endswith(('_sum', '_count')):
+                key = f"stage:{sample.labels['stage']}" if 'stage' in sample.labels else f"call:{sample.labels['service']}"
+                entry = totals.setdefault(key, {'calls': 0, 'total': 0.0})
+                entry['calls' if sample.name.endswith('_count') else 'total'] += sample.value
+    return {
+        key: {'calls': int(entry['calls']), 'total': entry['total'], 'mean': entry['total'] / entry['calls'] if entry['calls'] else 0.0}
+        for key, entry in sorted(totals.items())
+    }
+
+def summarize(results, duration: float):
+    latencies = [latency for latency, ok, _ in results if ok]
+    degradations = {}
+    for _, _, applied in results:
+        for name in applied:
+            degradations[name] = degradations.get(name, 0) + 1
+    return {
+        'requests': len(results),
+        'errors': sum(1 for _, ok, _ in results if not ok),
+        'degradations': dict(sorted(degradations.items())),
+        'duration': duration,
+        'throughput': len(latencies) / duration if duration else 0.0,
+        'latency': {
+            'mean': sum(latencies) / len(latencies) if latencies else 0.0,
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'max': max(latencies, default=0.0),
+        },
+    }
+
+def print_report(report: dict):
+    summary = report['summary']
+    latency = summary['latency']
+    print(f"\nЗапросов: {summary['requests']}, ошибок: {summary['errors']}, время: {summary['duration']:.2f} с")
+    print(f"Пропускная способность: {summary['throughput']:.2f} запр./с")
+    print(f"Задержка, с: mean {latency['mean']:.2f}  p50 {latency['p50']:.2f}  p95 {latency['p95']:.2f}  "
+          f"p99 {latency['p99']:.2f}  max {latency['max']:.2f}")
+    if summary.get('degradations'):
+        print('Деградации по дедлайну: ' + ', '.join(f'{name} {count}' for name, count in summary['degradations'].items()))
+    print('\nЭтапы (по данным заглушек):')
+    print(f'{"этап":<14}{"вызовов":>9}{"всего, с":>11}{"среднее, с":>12}')
+    for stage, values in report['stages'].items():
+        print(f'{stage:<14}{values["calls"]:>9}{values["total"]:>11.2f}{values["mean"]:>12.3f}')
+    print('\nЭтапы (по метрикам сервиса, /metrics):')
+    print(f'{"этап":<22}{"вызовов":>9}{"всего, с":>11}{"среднее, с":>12}')
+    for stage, values in report['app_stages'].items():
+        print(f'{stage:<22}{values["calls"]:>9}{values["total"]:>11.2f}{values["mean"]:>12.3f}')
+
+def compare(report: dict, baseline_path: Path, tolerance: float):
+    """
+    Сравнивает прогон с сохраненным и возвращает True, если найдена регрессия:
+    пропускная способность упала или p95 вырос больше чем на `tolerance`.
+    """
+    baseline = json.loads(baseline_path.read_text(encoding='utf-8'))['summary']
+    current = report['summary']
+    print(f'\nСравнение с {baseline_path}:')
+    rows = [('throughput', baseline['throughput'], current['throughput'])]
+    rows += [(name, baseline['latency'][name], current['latency'][name]) for name in ('p50', 'p95', 'p99')]
+    for name, before, after in rows:
+        change = (after - before) / before * 100 if before else 0.0
+        print(f'{name:<12}{before:>10.2f} -> {after:<10.2f}{change:+.1f}%')
+
+    regression = (
+        current['throughput'] < baseline['throughput'] * (1 - tolerance)
+        or current['latency']['p95'] > baseline['latency']['p95'] * (1 + tolerance)
+    )
+    print('Регрессия!' if regression else 'Регрессии нет')
+    return regression
+
+async def main(args):
+    env_overrides = dict(item.split('=', 1) for item in args.env)
+    mocks = MockServices(
+        search_latency=args.search_latency, search_results=args.search_results,
+        gpt_latency=args.gpt_latency, gpt_rps=args.gpt_rps, gpt_429_prob=args.gpt_429_prob,
+        page_latency=args.page_latency, page_error_prob=args.page_error_prob,
+        useful_prob=args.useful_prob, page_hosts=args.page_hosts, seed=args.seed,
+    )
+    await mocks.start()
+    RESULTS.mkdir(exist_ok=True)
+    name = args.name or datetime.now().strftime('%Y%m%d-%H%M%S')
+    process, base_url, log = await start_app(mocks, env_overrides, RESULTS / f'{name}.app.log')
+    try:
+        items = load_queries(Path(args.input), args.repeat)
+        started = time.monotonic()
+        if args.batch:
+            results = await run_batch(base_url, items)
+        else:
+            results = await run_requests(base_url, items, args.concurrency)
+        duration = time.monotonic() - started
+        app_stages = await fetch_app_stages(base_url)
+    finally:
+        process.terminate()
+        process.wait()
+        log.close()
+        await mocks.stop()
+
+    report = {
+        'name': name,
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'config': {**vars(args), 'env': env_overrides},
+        'summary': summarize(results, duration),
+        'stages': mocks.stats(),
+        'app_stages': app_stages,
+    }
+    print_report(report)
+    result_path = RESULTS / f'{name}.json'
+    result_path.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding='utf-8')
+    print(f'\nРезультат сохранен в {result_path}')
+
+    if args.compare and compare(report, Path(args.compare), args.tolerance):
+        return 1
+    return 0
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--input', default=str(BENCHMARKS / 'queries.jsonl'), help='JSONL с вопросами {"id", "query"}')
+    parser.add_argument('--repeat', type=int, default=1, help='сколько раз прогнать вопросы из файла')
+    parser.add_argument('--concurrency', type=int, default=8, help='одновременных запросов к сервису')
+    parser.add_argument('--batch', action='store_true', help='отправить все вопросы одним запросом в /api/batch')
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE', help='переменные окружения для сервиса')
+    parser.add_argument('--name', help='имя прогона (по умолчанию — дата и время)')
+    parser.add_argument('--compare', help='JSON предыдущего прогона для сравнения')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='допустимое ухудшение при сравнении (доля)')
+    parser.add_argument('--search-latency', type=float, default=0.3, help='задержка поиска, с')
+    parser.add_argument('--search-results', type=int, default=8, help='документов в выдаче')
+    parser.add_argument('--gpt-latency', type=float, default=1.0, help='задержка GPT, с')
+    parser.add_argument('--gpt-rps', type=float, default=0.0, help='квота GPT, запр./с (0 — без квоты)')
+    parser.add_argument('--gpt-429-prob', type=float, default=0.0, help='вероятность случайного 429 от GPT')
+    parser.add_argument('--page-latency', type=float, default=0.2, help='задержка страниц, с')
+    parser.add_argument('--page-error-prob', type=float, default=0.0, help='вероятность 404 для страницы')
+    parser.add_argument('--page-hosts', type=int, default=8, help='сколько адресов 127.0.0.N использовать для страниц')
+    parser.add_argument('--useful-prob', type=float, default=0.6, help='вероятность, что источник полезен')
+    parser.add_argument('--seed', type=int, default=0, help='seed генератора случайных чисел заглушек')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main(parse_args())))
@@ -0,0 +1,177 @@
+"""
+Локальные заглушки внешних сервисов для нагрузочного тестирования:
+Yandex Search XML API, Yandex GPT completion API и страницы-источники.
+
+Все три живут в одном aiohttp-приложении:
+    GET  /search/xml      — выдача поиска со ссылками на /page/...
+    POST /gpt/completion  — ответы GPT с настраиваемой задержкой и ответами 429
+    GET  /page/{key}/{n}  — HTML-страницы из benchmarks/fixtures
+"""
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+from aiohttp import web
+
+FIXTURES = Path(__file__).resolve().parent / 'fixtures'
+
+
+class MockServices:
+    """
+    Заглушки Yandex Search, Yandex GPT и веб-страниц с настраиваемым поведением.
+
+    Attributes:
+        search_latency (float): Задержка ответа поиска (в секундах).
+        search_results (int): Сколько документов в выдаче.
+        gpt_latency (float): Средняя задержка ответа GPT (в секундах).
+        gpt_rps (float): Квота GPT (запросов в секунду), сверх которой отвечаем 429; 0 — без квоты.
+        gpt_429_prob (float): Вероятность ответить 429 независимо от квоты.
+        page_latency (float): Задержка ответа страницы (в секундах).
+        page_error_prob (float): Вероятность ответить на запрос страницы ошибкой 404.
+        useful_prob (float): Вероятность, что GPT сочтет источник полезным.
+        jitter (float): Разброс задержек: задержка выбирается из [l * (1 - jitter), l * (1 + jitter)].
+        page_hosts (int): На скольких адресах 127.0.0.N раздавать страницы, чтобы сервис видел
+            разные хосты, как в реальной выдаче (ограничения на хост не сводят загрузку к одному потоку).
+    """
+    def __init__(self, search_latency=0.3, search_results=8, gpt_latency=1.0, gpt_rps=0.0, gpt_429_prob=0.0,
+                 page_latency=0.2, page_error_prob=0.0, useful_prob=0.6, jitter=0.3, page_hosts=8, seed=0):
+        self.search_latency = search_latency
+        self.search_results = search_results
+        self.gpt_latency = gpt_latency
+        self.gpt_rps = gpt_rps
+        self.gpt_429_prob = gpt_429_prob
+        self.page_latency = page_latency
+        self.page_error_prob = page_error_prob
+        self.useful_prob = useful_prob
+        self.jitter = jitter
+        self.page_hosts = ['127.0.0.1']
+        self._extra_hosts = page_hosts - 1
+        self.random = random.Random(seed)
+        self.pages = [path.read_bytes() for path in sorted(FIXTURES.glob('*.html'))]
+        self.base_url = None
+        self.stages = {}  # этап -> [число вызовов, суммарное время ответа]
+        self._gpt_tokens = gpt_rps
+        self._gpt_updated = time.monotonic()
+        self._runner = None
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0):
+        """
+        Запускает заглушки; при port=0 порт выбирается свободный. Адрес сохраняется в base_url.
+        """
+        app = web.Application()
+        app.router.add_get('/search/xml', self.search)
+        app.router.add_post('/gpt/completion', self.gpt)
+        app.router.add_get('/page/{key}/{number}', self.page)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.base_url = f'http://{host}:{port}'
+        self.port = port
+        for number in range(2, 2 + self._extra_hosts):
+            try:
+                await web.TCPSite(self._runner, f'127.0.0.{number}', port).start()
+            except OSError:
+                # на некоторых системах (например, macOS) доступен только 127.0.0.1
+                break
+            self.page_hosts.append(f'127.0.0.{number}')
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def stats(self):
+        """
+        Возвращает число вызовов и время ответа заглушек по этапам.
+        """
+        return {
+            stage: {'calls': calls, 'total': total, 'mean': total / calls if calls else 0.0}
+            for stage, (calls, total) in sorted(self.stages.items())
+        }
+
+    def _record(self, stage: str, started: float):
+        entry = self.stages.setdefault(stage, [0, 0.0])
+        entry[0] += 1
+        entry[1] += time.monotonic() - started
+
+    async def _sleep(self, latency: float):
+        await asyncio.sleep(latency * self.random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    async def search(self, request):
+        started = time.monotonic()
+        query = request.query.get('query', '')
+        await self._sleep(self.search_latency)
+        key = hashlib.md5(query.encode('utf-8')).hexdigest()[:8]
+        docs = ''.join(
+            f'<group><doc><url>http://{self.page_hosts[(int(key, 16) + number) % len(self.page_hosts)]}:{self.port}/page/{key}/{number}</url>'
+            f'<headline>{escape(query[:40])} {number}</headline>'
+            f'<passages><passage>{escape(query[:120])}</passage></passages></doc></group>'
+            for number in range(self.search_results)
+        )
+        body = f'<?xml version="1.0" encoding="utf-8"?><yandexsearch><response><results><grouping>{docs}</grouping></results></response></yandexsearch>'
+        self._record('search', started)
+        return web.Response(text=body, content_type='text/xml')
+
+    async def page(self, request):
+        started = time.monotonic()
+        await self._sleep(self.page_latency)
+        if self.random.random() < self.page_error_prob:
+            self._record('page', started)
+            return web.Response(status=404)
+        number = int(request.match_info['number'])
+        self._record('page', started)
+        return web.Response(body=self.pages[number % len(self.pages)], content_type='text/html')
+
+    def _take_gpt_token(self):
+        if not self.gpt_rps:
+            return True
+        now = time.monotonic()
+        self._gpt_tokens = min(self.gpt_rps, self._gpt_tokens + (now - self._gpt_updated) * self.gpt_rps)
+        self._gpt_updated = now
+        if self._gpt_tokens < 1:
+            return False
+        self._gpt_tokens -= 1
+        return True
+
+    async def gpt(self, request):
+        started = time.monotonic()
+        if not self._take_gpt_token() or self.random.random() < self.gpt_429_prob:
+            self._record('gpt_429', started)
+            return web.json_response({'error': 'Too many requests'}, status=429)
+
+        payload = await request.json()
+        prompt = payload['messages'][0]['text']
+        await self._sleep(self.gpt_latency)
+        stage, text = self._complete(prompt)
+        self._record(stage, started)
+        return web.json_response({
+            'result': {
+                'alternatives': [{'message': {'role': 'assistant', 'text': text}, 'status': 'ALTERNATIVE_STATUS_FINAL'}],
+                'usage': {'inputTextTokens': str(len(prompt) // 4), 'completionTokens': str(len(text) // 4)},
+            }
+        })
+
+    def _complete(self, prompt: str):
+        """
+        Подбирает правдоподобный ответ по типу промпта. Возвращает (этап, текст ответа).
+        """
+        if 'JSON-список номеров' in prompt:
+            count = len(re.findall(r'Источник \d+:', prompt))
+            useful = [number for number in range(1, count + 1) if self.random.random() < self.useful_prob]
+            return 'gpt_filter', json.dumps(useful)
+        if 'Полезна ли' in prompt:
+            return 'gpt_filter', 'Да, полезна' if self.random.random() < self.useful_prob else 'Нет'
+
+        block = re.search(r'Есть ответы: (.*?)\. Ответь на вопрос', prompt, re.DOTALL)
+        options = [int(number) for number in re.findall(r'^\s*(\d+)[.)]', block.group(1), re.MULTILINE)] if block else []
+        options = options or [1]
+        answer = self.random.choice(options)
+        if 'строго в формате JSON' in prompt:
+            return 'gpt_answer', json.dumps({'answer': answer, 'reasoning': 'Ответ найден в источниках.'}, ensure_ascii=False)
+        return 'gpt_answer', f'{answer}. Ответ найден в источниках.'
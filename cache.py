@@ -0,0 +1,178 @@
+"""
+Многоуровневый кеш для результатов поиска, текстов страниц и ответов GPT.
+
+Первый уровень — LRU в памяти с TTL и ограничением по числу записей и размеру.
+Второй (необязательный) уровень — SQLite на диске, чтобы после перезапуска
+сервис стартовал с «теплым» кешем.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit, urlunsplit
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(query: str):
+    """
+    Приводит поисковый запрос к ключу кеша: нижний регистр и схлопнутые пробелы.
+    """
+    return ' '.join(query.lower().split())
+
+def normalize_url(url: str):
+    """
+    Приводит URL к ключу кеша: схема и хост в нижнем регистре, без якоря (#...).
+    """
+    parts = urlsplit(url.strip())
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or '/', parts.query, ''))
+
+def prompt_key(prompt: str):
+    """
+    Возвращает ключ кеша для промпта — его SHA-256.
+    """
+    return hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+
+
+class SQLiteStore:
+    """
+    Дисковый уровень кеша: одна таблица на все кеши, записи разделены по namespace.
+
+    Attributes:
+        path (str): Путь к файлу базы данных.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache ('
+                'namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL NOT NULL, '
+                'PRIMARY KEY (namespace, key))'
+            )
+            # устаревшие записи чистим при старте
+            self._conn.execute('DELETE FROM cache WHERE expires_at <= ?', (time.time(),))
+
+    def get(self, namespace: str, key: str):
+        """
+        Возвращает кортеж (значение, момент истечения) или None, если записи нет или она устарела.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?', (namespace, key)
+            ).fetchone()
+        if row is None or row[1] <= time.time():
+            return None
+        return row
+
+    def items(self, namespace: str, limit: int):
+        """
+        Возвращает до `limit` неустаревших записей namespace — кортежи (ключ, значение, момент истечения),
+        начиная с самых свежих.
+        """
+        with self._lock:
+            return self._conn.execute(
+                'SELECT key, value, expires_at FROM cache WHERE namespace = ? AND expires_at > ? '
+                'ORDER BY expires_at DESC LIMIT ?', (namespace, time.time(), limit)
+            ).fetchall()
+
+    def set(self, namespace: str, key: str, value: str, expires_at: float):
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)',
+                (namespace, key, value, expires_at)
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class TieredCache:
+    """
+    Кеш с LRU-уровнем в памяти и необязательным уровнем SQLite.
+
+    Значения хранятся сериализованными в JSON, поэтому кешировать можно только
+    то, что в JSON представимо (кортежи при чтении становятся списками).
+
+    Attributes:
+        name (str): Имя кеша (namespace в SQLite и метка в статистике).
+        ttl (float): Время жизни записи (в секундах).
+        max_entries (int): Максимум записей в памяти.
+        max_bytes (int): Максимальный суммарный размер значений в памяти (в байтах).
+        store (SQLiteStore или None): Дисковый уровень.
+    """
+    def __init__(self, name: str, ttl: float, max_entries: int, max_bytes: int, store: SQLiteStore = None):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.store = store
+        self._entries = OrderedDict()  # ключ -> (значение в JSON, размер, момент истечения)
+        self._size = 0
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0}
+
+    async def get(self, key: str):
+        """
+        Возвращает значение по ключу или None при промахе.
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[2] > time.time():
+                self._entries.move_to_end(key)
+                self._stats['memory_hits'] += 1
+                return json.loads(entry[0])
+            self._remove(key)
+
+        if self.store is not None:
+            row = await asyncio.to_thread(self.store.get, self.name, key)
+            if row is not None:
+                self._stats['disk_hits'] += 1
+                self._put(key, row[0], row[1])
+                return json.loads(row[0])
+
+        self._stats['misses'] += 1
+        return None
+
+    async def set(self, key: str, value):
+        """
+        Сохраняет значение в память и, если он включен, на диск.
+        """
+        payload = json.dumps(value, ensure_ascii=False)
+        expires_at = time.time() + self.ttl
+        self._put(key, payload, expires_at)
+        if self.store is not None:
+            try:
+                await asyncio.to_thread(self.store.set, self.name, key, payload, expires_at)
+            except sqlite3.Error as e:
+                logger.info(f'Кеш {self.name}: не удалось записать на диск: {e}')
+
+    def stats(self):
+        """
+        Возвращает счетчики попаданий и промахов, а также текущий размер кеша в памяти.
+        """
+        return {**self._stats, 'entries': len(self._entries), 'bytes': self._size}
+
+    def _put(self, key: str, payload: str, expires_at: float):
+        # прежнее значение убираем в любом случае, даже если новое в память не поместится
+        if key in self._entries:
+            self._remove(key)
+        size = len(payload.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (payload, size, expires_at)
+        self._size += size
+        # вытесняем самые давно использованные записи
+        while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self._stats['evictions'] += 1
+
+    def _remove(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self._size -= size
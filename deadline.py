@@ -0,0 +1,114 @@
+"""
+Дедлайн обработки запроса.
+
+Дедлайн хранится в контекстной переменной, поэтому его видят все этапы запроса
+и порожденные ими задачи, без передачи через аргументы. Внешние вызовы
+урезают свои таймауты до оставшегося времени (budget), а этапы конвейера могут
+сузить дедлайн для вложенной работы (deadline_scope), чтобы оставить время на следующий этап.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+class DeadlineExceeded(Exception):
+    """
+    Время на обработку запроса закончилось.
+    """
+
+
+class Deadline:
+    """
+    Момент, к которому обработка запроса должна завершиться.
+
+    Attributes:
+        expires_at (float): Момент по time.monotonic().
+        seconds (float): Сколько секунд было отведено на запрос целиком (None для суженного дедлайна).
+    """
+    def __init__(self, expires_at: float, seconds: float = None):
+        self.expires_at = expires_at
+        self.seconds = seconds
+
+    @classmethod
+    def after(cls, seconds: float):
+        return cls(time.monotonic() + seconds, seconds)
+
+    def remaining(self):
+        """
+        Сколько секунд осталось (не меньше нуля).
+        """
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def expired(self):
+        return time.monotonic() >= self.expires_at
+
+
+_deadline = ContextVar('deadline', default=None)
+
+
+def current_deadline():
+    """
+    Возвращает дедлайн текущего контекста или None, если он не задан.
+    """
+    return _deadline.get()
+
+def set_deadline(seconds: float):
+    """
+    Задает дедлайн через `seconds` секунд для текущего контекста (запроса и порожденных им задач).
+
+    Возвращает:
+        Token: Токен для reset_deadline.
+    """
+    return _deadline.set(Deadline.after(seconds))
+
+def reset_deadline(token):
+    _deadline.reset(token)
+
+def time_left():
+    """
+    Возвращает, сколько секунд осталось до дедлайна, или None, если дедлайна нет.
+    """
+    deadline = _deadline.get()
+    return None if deadline is None else deadline.remaining()
+
+def budget(timeout: float):
+    """
+    Урезает собственный таймаут операции до времени, оставшегося до дедлайна.
+
+    Аргументы:
+        timeout (float): Таймаут операции без учета дедлайна.
+
+    Возвращает:
+        float: Таймаут, который можно дать операции.
+
+    Исключения:
+        DeadlineExceeded: Если времени не осталось.
+    """
+    deadline = _deadline.get()
+    if deadline is None:
+        return timeout
+    remaining = deadline.remaining()
+    if remaining <= 0:
+        raise DeadlineExceeded()
+    return min(timeout, remaining)
+
+@contextmanager
+def deadline_scope(reserve: float):
+    """
+    Сужает дедлайн внутри блока так, чтобы после него осталось `reserve` секунд.
+
+    Если дедлайна нет, блок выполняется без ограничений.
+
+    Возвращает:
+        Deadline или None: Дедлайн блока.
+    """
+    deadline = _deadline.get()
+    if deadline is None:
+        yield None
+        return
+    scoped = Deadline(deadline.expires_at - reserve)
+    token = _deadline.set(scoped)
+    try:
+        yield scoped
+    finally:
+        _deadline.reset(token)
@@ -0,0 +1,193 @@
+"""
+Извлечение основного текста из HTML-страниц.
+
+Функции модуля не зависят от состояния приложения, поэтому их можно
+выполнять в отдельных процессах (см. run_extraction в main.py).
+"""
+import re
+from html.parser import HTMLParser
+
+from bs4 import BeautifulSoup
+
+# теги, текст которых не показывается пользователю
+_SKIP_TAGS = {'script', 'style', 'template', 'noscript'}
+# теги, которые по правилам HTML закрывают незакрытый <p>
+_CLOSES_P = {
+    'address', 'article', 'aside', 'blockquote', 'div', 'dl', 'fieldset', 'footer', 'form',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hr', 'main', 'nav', 'ol', 'p', 'pre',
+    'section', 'table', 'ul',
+}
+_META_CHARSET = re.compile(rb'<meta[^>]+charset=["\']?([\w-]+)', re.IGNORECASE)
+_CHUNK_SIZE = 64 * 1024
+
+
+def parse_main_text(content: bytes):
+    """
+    Извлекает основной текст из HTML-контента страницы.
+
+    HTML парсится с помощью BeautifulSoup, текст ищется в тегах
+    <article>, <main> или <p> (именно в таком порядке).
+
+    Аргументы:
+        content (bytes): HTML-контент страницы.
+
+    Возвращает:
+        str: Основной текст страницы или "Нет", если текст в ожидаемых тегах не найден.
+    """
+    # Парсим HTML-страницу
+    soup = BeautifulSoup(content, 'html.parser')
+
+    # Попробуем найти текст из различных типов тегов
+    # 1. Ищем в <article> (часто используется для основной статьи)
+    article = soup.find('article')
+    if article:
+        return article.get_text(separator=' ', strip=True)
+
+    # 2. Ищем в <main> (некоторые страницы используют это как основной блок контента)
+    main = soup.find('main')
+    if main:
+        return main.get_text(separator=' ', strip=True)
+
+    # 3. Ищем в теге <p> (параграфы могут содержать основную информацию)
+    paragraphs = soup.find_all('p')
+    if paragraphs:
+        return ' '.join([p.get_text(strip=True) for p in paragraphs])
+
+    # 4. Если ничего не нашли, возвращаем ошибку
+    return "Нет"
+
+
+class _MainTextParser(HTMLParser):
+    """
+    Потоковый парсер, который за один проход собирает текст первого <article>,
+    первого <main> и всех <p>, не строя дерево документа.
+
+    Каждый из трех текстов перестает пополняться, как только набрал `limit` символов.
+    Разбор можно прекратить (флаг done), когда <article> закрыт или уже набрал
+    достаточно текста: он в приоритете, и остаток страницы на результат не влияет.
+
+    Страница подается кусками, и на границе куска текстовый узел приходит в handle_data
+    по частям. Поэтому части копятся в буфере и обрабатываются целиком на следующем
+    теге или в result(), иначе слово на границе куска оказалось бы разрезано пробелом.
+    """
+    def __init__(self, limit: int):
+        super().__init__(convert_charrefs=True)
+        self.limit = limit
+        self.done = False
+        self.article = []
+        self.main = []
+        self.paragraphs = []
+        self._lengths = {'article': 0, 'main': 0, 'p': 0}
+        self._depth = {'article': 0, 'main': 0}  # вложенность внутри первого <article>/<main>
+        self._seen = {'article': False, 'main': False}
+        self._in_paragraph = False
+        self._skip = 0
+        self._pending = []  # части текущего текстового узла
+
+    def handle_starttag(self, tag, attrs):
+        self._flush()
+        if tag in _SKIP_TAGS:
+            self._skip += 1
+            return
+        if tag in _CLOSES_P:
+            self._in_paragraph = False
+        if tag in self._depth:
+            if self._depth[tag]:
+                self._depth[tag] += 1
+            elif not self._seen[tag]:
+                self._seen[tag] = True
+                self._depth[tag] = 1
+        if tag == 'p':
+            self._in_paragraph = True
+            self.paragraphs.append([])
+
+    def handle_endtag(self, tag):
+        self._flush()
+        if tag in _SKIP_TAGS:
+            self._skip = max(self._skip - 1, 0)
+            return
+        if tag == 'p':
+            self._in_paragraph = False
+        if tag in self._depth and self._depth[tag]:
+            self._depth[tag] -= 1
+            if tag == 'article' and self._depth[tag] == 0:
+                self.done = True
+
+    def handle_comment(self, data):
+        self._flush()
+
+    def handle_data(self, data):
+        if not self._skip:
+            self._pending.append(data)
+
+    def _flush(self):
+        text = ''.join(self._pending).strip()
+        self._pending = []
+        if not text:
+            return
+        if self._depth['article'] and self._lengths['article'] < self.limit:
+            self.article.append(text)
+            self._lengths['article'] += len(text) + 1
+            if self._lengths['article'] >= self.limit:
+                self.done = True
+        if self._depth['main'] and self._lengths['main'] < self.limit:
+            self.main.append(text)
+            self._lengths['main'] += len(text) + 1
+        if self._in_paragraph and self._lengths['p'] < self.limit:
+            self.paragraphs[-1].append(text)
+            self._lengths['p'] += len(text)
+
+    def result(self):
+        self._flush()
+        if self._seen['article']:
+            return ' '.join(self.article)
+        if self._seen['main']:
+            return ' '.join(self.main)
+        if self.paragraphs:
+            return ' '.join(''.join(pieces) for pieces in self.paragraphs)
+        return "Нет"
+
+
+def decode_html(content: bytes, encoding: str = None):
+    """
+    Декодирует HTML: кодировка берется из заголовка ответа, затем из <meta charset>,
+    иначе пробуется UTF-8 и, при ошибке, windows-1251.
+    """
+    if encoding is None:
+        match = _META_CHARSET.search(content[:2048])
+        if match:
+            encoding = match.group(1).decode('ascii')
+    if encoding is not None:
+        try:
+            return content.decode(encoding, errors='replace')
+        except LookupError:
+            pass
+    try:
+        return content.decode('utf-8')
+    except UnicodeDecodeError:
+        return content.decode('cp1251', errors='replace')
+
+def extract_main_text_fast(content: bytes, limit: int, encoding: str = None):
+    """
+    Быстрая замена parse_main_text с тем же порядком поиска: <article>, <main>, <p>.
+
+    Страница разбирается потоково, без построения дерева, и разбор
+    прекращается, как только результат уже не может измениться.
+
+    Аргументы:
+        content (bytes): HTML-контент страницы.
+        limit (int): Сколько символов текста достаточно.
+        encoding (str, optional): Кодировка из заголовков ответа.
+
+    Возвращает:
+        str: Не более `limit` символов основного текста или "Нет", если текст не найден.
+    """
+    text = decode_html(content, encoding)
+    parser = _MainTextParser(limit)
+    for start in range(0, len(text), _CHUNK_SIZE):
+        parser.feed(text[start:start + _CHUNK_SIZE])
+        if parser.done:
+            break
+    else:
+        parser.close()
+    return parser.result()[:limit]
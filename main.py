@@ -1,16 +1,34 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
-import requests
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, ValidationError
 import re
 from dotenv import load_dotenv
 import os
 import xml.etree.ElementTree as ET
-from bs4 import BeautifulSoup
 import aiohttp
 import asyncio
 import logging
+import json
+import time
 from itertools import chain
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+from contextlib import asynccontextmanager
+from typing import Optional
+from urllib.parse import urlsplit
+from cache import SQLiteStore, TieredCache, normalize_query, normalize_url, prompt_key
+from extraction import extract_main_text_fast, parse_main_text
+from passages import select_passages, trim_passages
+from rate_limiter import AdaptiveRateLimiter
+from similar_questions import QuestionIndex, remap_answer
+from deadline import DeadlineExceeded, budget, current_deadline, deadline_scope, reset_deadline, set_deadline, time_left
+from metrics import (
+    GPT_ATTEMPTS, GPT_LIMITER_QUEUE_DEPTH, GPT_LIMITER_RATE, GPT_LIMITER_WAIT_SECONDS, GPT_RETRIES,
+    external_call, finish_trace, stage, start_trace,
+)
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -21,9 +39,156 @@ folder_id = os.getenv('FOLDER_ID')
 yandexgpt_key = os.getenv('YANDEXGPT_KEY')
 yandex_search_key = os.getenv('YANDEX_SEARCH_KEY')
 
-app = FastAPI()
+# ограничения на загрузку страниц-источников
+# всего одновременных загрузок на процесс; по умолчанию — размер пула HTTP-соединений,
+# чтобы одновременные запросы (каждый загружает до 8 страниц) не ждали друг друга
+fetch_concurrency = int(os.getenv('FETCH_CONCURRENCY', os.getenv('HTTP_POOL_SIZE', 100)))
+fetch_per_host = int(os.getenv('FETCH_PER_HOST', 2))  # одновременных загрузок с одного хоста
+fetch_timeout = float(os.getenv('FETCH_TIMEOUT', 10))  # таймаут загрузки одной страницы (в секундах)
+fetch_max_bytes = int(os.getenv('FETCH_MAX_BYTES', 1024 * 1024))  # сколько байт страницы скачивать, остальное отбрасывается
+max_sources = 3  # сколько полезных источников нужно для ответа
+page_text_chars = int(os.getenv('PAGE_TEXT_CHARS', 20000))  # сколько символов текста страницы извлекать для отбора фрагментов
+passage_chars = int(os.getenv('PASSAGE_CHARS', 400))  # длина фрагмента, на которые режется текст страницы
+source_token_budget = int(os.getenv('SOURCE_TOKEN_BUDGET', 300))  # сколько токенов лучших фрагментов источника идет в промпты
+batch_concurrency = int(os.getenv('BATCH_CONCURRENCY', 8))  # сколько вопросов из /api/batch обрабатывается одновременно
 
-yandex_gpt_api_url = 'https://llm.api.cloud.yandex.net/foundationModels/v1/completion'
+# извлечение текста: 'fast' — потоковый парсер, 'bs4' — прежний разбор через BeautifulSoup
+extractor = os.getenv('EXTRACTOR', 'fast')
+extract_workers = int(os.getenv('EXTRACT_WORKERS', min(4, os.cpu_count() or 1)))  # 0 — разбирать в потоке, без пула процессов
+
+# режим фильтрации источников: 'single' — отдельный вызов GPT на каждый источник, 'batch' — один вызов на пачку
+relevance_mode = os.getenv('RELEVANCE_MODE', 'single')
+relevance_batch_size = int(os.getenv('RELEVANCE_BATCH_SIZE', 8))  # сколько источников в одном вызове GPT
+relevance_batch_chars = int(os.getenv('RELEVANCE_BATCH_CHARS', 1000))  # сколько символов каждого источника попадает в промпт
+
+# пул HTTP-соединений, общий для поиска, GPT и загрузки страниц
+http_pool_size = int(os.getenv('HTTP_POOL_SIZE', 100))  # всего открытых соединений
+http_pool_per_host = int(os.getenv('HTTP_POOL_PER_HOST', 20))  # соединений с одним хостом
+http_dns_ttl = int(os.getenv('HTTP_DNS_TTL', 300))  # время жизни DNS-кеша (в секундах)
+http_keepalive = float(os.getenv('HTTP_KEEPALIVE', 30))  # сколько держать простаивающее соединение (в секундах)
+http_connect_timeout = float(os.getenv('HTTP_CONNECT_TIMEOUT', 5))  # таймаут установки соединения (в секундах)
+search_timeout = float(os.getenv('SEARCH_TIMEOUT', 10))  # таймаут запроса к поиску (в секундах)
+gpt_timeout = float(os.getenv('GPT_TIMEOUT', 60))  # таймаут запроса к GPT (в секундах)
+
+# общий для процесса ограничитель частоты запросов к GPT
+priority_answer = 0  # вызовы для финального ответа обслуживаются первыми
+priority_filter = 1  # вызовы для фильтрации источников
+gpt_limiter = AdaptiveRateLimiter(
+    rate=float(os.getenv('GPT_RATE', 10)),  # начальная скорость (запросов в секунду)
+    min_rate=float(os.getenv('GPT_RATE_MIN', 0.5)),
+    max_rate=float(os.getenv('GPT_RATE_MAX', 20)),
+    increase=float(os.getenv('GPT_RATE_INCREASE', 0.5)),  # прирост скорости за секунду без 429
+    burst=float(os.getenv('GPT_BURST', 5)),  # сколько запросов можно отправить разом
+    priority_names={priority_answer: 'answer', priority_filter: 'filter'},
+)
+GPT_LIMITER_RATE.set_function(lambda: gpt_limiter.rate)
+GPT_LIMITER_QUEUE_DEPTH.set_function(lambda: gpt_limiter.stats()['queue_depth'])
+
+# дедлайн обработки запроса: при нехватке времени конвейер урезает отбор источников, а не ответ
+request_deadline = float(os.getenv('REQUEST_DEADLINE', 60))  # секунд на запрос, если клиент не передал X-Request-Deadline; 0 — без дедлайна
+deadline_answer_reserve = float(os.getenv('DEADLINE_ANSWER_RESERVE', 10))  # сколько секунд до дедлайна оставлять на финальный ответ GPT
+deadline_filter_min = float(os.getenv('DEADLINE_FILTER_MIN', 5))  # если на отбор источников осталось меньше, полезность через GPT не проверяется
+
+trace_log = os.getenv('TRACE_LOG', '0') == '1'  # писать ли трассу каждого запроса в логгер "trace"
+
+# кеш поиска, текстов страниц и ответов GPT
+cache_max_entries = int(os.getenv('CACHE_MAX_ENTRIES', 10000))  # записей в памяти на каждый кеш
+cache_max_bytes = int(os.getenv('CACHE_MAX_BYTES', 64 * 1024 * 1024))  # байт в памяти на каждый кеш
+cache_db_path = os.getenv('CACHE_DB_PATH')  # файл SQLite для дискового уровня; если не задан, кеш только в памяти
+
+cache_store = SQLiteStore(cache_db_path) if cache_db_path else None
+search_cache = TieredCache('search', float(os.getenv('CACHE_TTL_SEARCH', 3600)), cache_max_entries, cache_max_bytes, cache_store)
+page_cache = TieredCache('page', float(os.getenv('CACHE_TTL_PAGE', 86400)), cache_max_entries, cache_max_bytes, cache_store)
+gpt_cache = TieredCache('gpt', float(os.getenv('CACHE_TTL_GPT', 86400)), cache_max_entries, cache_max_bytes, cache_store)
+
+# индекс похожих вопросов: похожий вопрос берет источники уже обработанного, а тот же самый — и его ответ
+similar_max_entries = int(os.getenv('SIMILAR_MAX_ENTRIES', 10000))  # сколько вопросов помнить; 0 — индекс выключен
+similar_threshold = float(os.getenv('SIMILAR_THRESHOLD', 0.9))  # минимальное сходство (0..1), чтобы взять источники похожего вопроса
+similar_questions = QuestionIndex(
+    similar_max_entries, similar_threshold, float(os.getenv('SIMILAR_TTL', 86400)), cache_store
+) if similar_max_entries > 0 else None
+
+http_session = None
+extract_pool = None
+
+def get_http_session():
+    """
+    Возвращает общую HTTP-сессию процесса, создавая её при необходимости.
+
+    Обычно сессия открывается при старте приложения (см. lifespan), но функции
+    клиентов можно вызывать и вне FastAPI — тогда сессия создается при первом обращении.
+
+    Возвращает:
+        aiohttp.ClientSession: Сессия с пулом keep-alive соединений и DNS-кешем.
+    """
+    global http_session
+    if http_session is None or http_session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=http_pool_size,
+            limit_per_host=http_pool_per_host,
+            ttl_dns_cache=http_dns_ttl,
+            keepalive_timeout=http_keepalive,
+        )
+        http_session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(sock_connect=http_connect_timeout),
+        )
+    return http_session
+
+async def close_http_session():
+    """
+    Закрывает общую HTTP-сессию и все соединения её пула.
+    """
+    global http_session
+    if http_session is not None and not http_session.closed:
+        await http_session.close()
+    http_session = None
+
+def get_extract_pool():
+    """
+    Возвращает пул процессов для разбора HTML или None, если он отключен (EXTRACT_WORKERS=0).
+    """
+    global extract_pool
+    if extract_pool is None and extract_workers > 0:
+        # spawn: не копируем в дочерние процессы состояние работающего цикла событий и потоков
+        extract_pool = ProcessPoolExecutor(extract_workers, mp_context=multiprocessing.get_context('spawn'))
+    return extract_pool
+
+async def warm_extract_pool():
+    """
+    Запускает процессы пула заранее, чтобы первый запрос не ждал их старта.
+    """
+    pool = get_extract_pool()
+    if pool is not None:
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(pool, partial(extract_main_text_fast, b'', 1)) for _ in range(extract_workers)))
+
+def close_extract_pool():
+    """
+    Останавливает пул процессов для разбора HTML.
+    """
+    global extract_pool
+    if extract_pool is not None:
+        extract_pool.shutdown(wait=False, cancel_futures=True)
+    extract_pool = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # одна сессия на воркер: соединения переиспользуются между запросами
+    get_http_session()
+    await warm_extract_pool()
+    if similar_questions is not None:
+        await similar_questions.load()
+    yield
+    await close_http_session()
+    close_extract_pool()
+    if cache_store is not None:
+        cache_store.close()
+
+app = FastAPI(lifespan=lifespan)
+
+yandex_gpt_api_url = os.getenv('YANDEX_GPT_API_URL', 'https://llm.api.cloud.yandex.net/foundationModels/v1/completion')
+yandex_search_api_url = os.getenv('YANDEX_SEARCH_API_URL', 'https://yandex.ru/search/xml')
 
 class QueryRequest(BaseModel):
     """
@@ -36,74 +201,178 @@ class QueryRequest(BaseModel):
     id: int
     query: str
 
-def yandex_search(query: str):
+def parse_search_xml(text: str, query: str):
+    """
+    Разбирает XML-ответ Яндекс Поиска в список результатов.
+
+    Аргументы:
+        text (str): Тело ответа API в формате XML.
+        query (str): Исходный запрос (используется только для логирования).
+
+    Возвращает:
+        list: Список кортежей (заголовок, URL, сниппет) в порядке выдачи; сниппет — текст пассажей документа.
+    """
+    root = ET.fromstring(text)
+    results = []
+    # Проверяем, если нет найденных документов
+    if len(root.findall(".//doc")) == 0:
+        logger.info(f'Запрос {query[:20]}, слишком быстро')
+    # Извлекаем информацию из каждого документа
+    for doc in root.findall(".//doc"):
+        url = doc.find("url").text if doc.find("url") is not None else "Нет ссылки"
+        title = doc.find("headline").text if doc.find("headline") is not None else "Нет описания"
+        snippet = ' '.join(''.join(passage.itertext()).strip() for passage in doc.iter("passage"))
+        results.append((title, url, snippet))
+    return results
+
+async def yandex_search(query: str):
     """
-    Выполняет поиск по запросу на Яндексе с использованием API Яндекса.
+    Выполняет асинхронный поиск по запросу на Яндексе с использованием API Яндекса.
+
+    Разбор XML выполняется в отдельном потоке, чтобы не блокировать цикл событий.
 
     Аргументы:
         query (str): Строка поискового запроса.
 
     Возвращает:
-        list или str: Если запрос успешен, возвращает список из кортежей с заголовками и URL-адресами.
+        list или str: Если запрос успешен, возвращает список кортежей (заголовок, URL, сниппет).
         Если произошла ошибка, возвращает строку с описанием ошибки.
     """
-    user = 'default'
-    url = 'https://yandex.ru/search/xml'
-    params = {
-        'user': user,
-        'apikey': yandex_search_key,
-        'l10n': 'ru',
-        'query': query,
-        'folderid': folder_id
-    }
+    with external_call('search') as call:
+        cache_key = normalize_query(query)
+        cached = await search_cache.get(cache_key)
+        if cached is not None:
+            call.outcome = 'cache'
+            # в записях, закешированных прежними версиями, сниппета нет
+            return [(*result, '')[:3] for result in cached]
 
-    try:
-        # Выполняем GET-запрос с параметрами
-        response = requests.get(url, params=params)
-        # Если статус 200, то разбираем ответ
-        if response.status_code == 200:
-            text = response.text 
-            root = ET.fromstring(text)
-            results = []
-            # Проверяем, если нет найденных документов
-            if len(root.findall(".//doc")) == 0:
-                logger.info(f'Запрос {query[:20]}, слишком быстро')
-             # Извлекаем информацию из каждого документа
-            for doc in root.findall(".//doc"):
-                url = doc.find("url").text if doc.find("url") is not None else "Нет ссылки"
-                title = doc.find("headline").text if doc.find("headline") is not None else "Нет описания"
-                results.append((title, url))
-            return results
+        params = {
+            'user': 'default',
+            'apikey': yandex_search_key,
+            'l10n': 'ru',
+            'query': query,
+            'folderid': folder_id
+        }
+
+        try:
+            # Выполняем GET-запрос с параметрами
+            session = get_http_session()
+            timeout = aiohttp.ClientTimeout(total=budget(search_timeout), sock_connect=http_connect_timeout)
+            async with session.get(yandex_search_api_url, params=params, timeout=timeout) as response:
+                # Если статус не 200, возвращаем описание ошибки
+                if response.status != 200:
+                    call.outcome = 'http_error'
+                    return f"Ошибка: {response.status}"
+                text = await response.text()
+            # Разбираем ответ вне цикла событий
+            results = await asyncio.to_thread(parse_search_xml, text, query)
+        except DeadlineExceeded:
+            call.outcome = 'deadline'
+            return "Ошибка: истек дедлайн запроса"
+        except Exception as e:
+            call.outcome = 'error'
+            return f"Ошибка запроса: {str(e)}"
+
+        # пустую выдачу не кешируем: обычно это значит, что запросы шли слишком быстро
+        if results:
+            await search_cache.set(cache_key, results)
         else:
-            return f"Ошибка: {response.status_code}"
-    except Exception as e:
-        return f"Ошибка запроса: {str(e)}"
+            call.outcome = 'empty'
+        return results
+
+async def search_sources(*queries: str, limit: int = 4):
+    """
+    Параллельно ищет несколько вариантов запроса и объединяет выдачу.
+
+    Результаты чередуются так же, как раньше в handle_request
+    (``chain(*zip(...))`` по непустым выдачам), а повторяющиеся URL отбрасываются.
+
+    Аргументы:
+        *queries (str): Варианты запроса (например, весь вопрос с ответами и сам вопрос).
+        limit (int): Сколько первых результатов брать из каждой выдачи.
+
+    Возвращает:
+        list: Список кортежей (заголовок, URL, сниппет) без повторов.
+    """
+    # одинаковые формулировки ищем один раз
+    unique_queries = list(dict.fromkeys(queries))
+    responses = await asyncio.gather(*(yandex_search(q) for q in unique_queries))
+
+    # ошибки поиска приходят строкой, такие выдачи пропускаем
+    results = [r[:limit] for r in responses if isinstance(r, list) and r]
+    if not results:
+        return []
 
-async def yandex_gpt(query: str):
+    urls = []
+    seen = set()
+    for title, url, snippet in chain(*zip(*results)):
+        if url in seen:
+            continue
+        seen.add(url)
+        urls.append((title, url, snippet))
+    return urls
+
+def parse_retry_after(value: str):
+    """
+    Переводит заголовок Retry-After (в секундах) в число или None, если заголовка нет или он в другом формате.
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+async def yandex_gpt(query: str, priority: int = priority_answer):
     """
     Выполняет асинхронный запрос к API Яндекс GPT с заданным запросом.
 
+    Частотой запросов управляет общий gpt_limiter: каждая попытка ждет
+    разрешения в очереди с приоритетом, а ответ 429 снижает скорость для всего процесса.
+    Ожидание в очереди и сами попытки ограничены дедлайном запроса (см. deadline.py).
+
     Аргументы:
         query (str): Строка поискового запроса, которую нужно передать в GPT.
+        priority (int): priority_answer для финального ответа, priority_filter для фильтрации источников.
 
     Возвращает:
         dict: Ответ от API, либо сообщение об ошибке в случае неудачи.
+
+    Исключения:
+        DeadlineExceeded: Если ответ не получен до дедлайна запроса.
     """
-    # Сообщения, которые будут отправлены в модель GPT
-    messages = [
-        {
-            "role": "user",
-            "text": query
-        }
-    ]
-    
-    retries = 100  # Число попыток
-    delay = 1  # Задержка между попытками (в секундах)
-    
-    for attempt in range(retries):
-        try:
-            # Создаем асинхронную сессию для отправки запроса
-            async with aiohttp.ClientSession() as session:
+    with external_call(f'gpt_{gpt_limiter.priority_names[priority]}') as call:
+        cache_key = prompt_key(query)
+        cached = await gpt_cache.get(cache_key)
+        if cached is not None:
+            call.outcome = 'cache'
+            return cached
+
+        # Сообщения, которые будут отправлены в модель GPT
+        messages = [
+            {
+                "role": "user",
+                "text": query
+            }
+        ]
+
+        retries = 100  # Число попыток
+        call.attrs.update(attempts=0, throttled=0, limiter_wait=0.0)
+
+        for attempt in range(retries):
+            if attempt:
+                GPT_RETRIES.inc()
+            waited_from = time.monotonic()
+            try:
+                await asyncio.wait_for(gpt_limiter.acquire(priority), time_left())
+            except asyncio.TimeoutError:
+                raise DeadlineExceeded() from None
+            waited = time.monotonic() - waited_from
+            GPT_LIMITER_WAIT_SECONDS.labels(gpt_limiter.priority_names[priority]).observe(waited)
+            call.attrs['limiter_wait'] = round(call.attrs['limiter_wait'] + waited, 4)
+            call.attrs['attempts'] += 1
+            timeout = aiohttp.ClientTimeout(total=budget(gpt_timeout), sock_connect=http_connect_timeout)
+            try:
+                # Отправляем запрос через общую сессию с пулом соединений
+                session = get_http_session()
                 async with session.post(
                     yandex_gpt_api_url,
                     headers={
@@ -117,31 +386,89 @@ async def yandex_gpt(query: str):
                             "temperature": 0.6
                         },
                         "messages": messages
-                    }
+                    },
+                    timeout=timeout
                 ) as response:
+                    GPT_ATTEMPTS.labels(str(response.status)).inc()
                     # Обрабатываем ошибку "слишком много запросов"
                     if response.status == 429:
-                        logger.info(f"Слишком много запросов. Попытка {attempt + 1} из {retries}. Ожидание {delay} сек.")
-                        await asyncio.sleep(delay)  # Задержка перед повторной попыткой
-                        delay += 1  # Увеличиваем задержку в случае очередной ошибки
+                        call.attrs['throttled'] += 1
+                        gpt_limiter.on_throttled(parse_retry_after(response.headers.get('Retry-After')))
+                        logger.info(f"Слишком много запросов. Попытка {attempt + 1} из {retries}. Скорость: {gpt_limiter.rate:.2f} запр./сек.")
                         continue
                     # Логируем ошибку при запросе, если статус не 200
                     if response.status != 200:
+                        call.outcome = 'http_error'
                         logger.info(f'Запрос {query[:20]}\n{response.status}\n{await response.text()}')
                         return 'Не знаю'
+                    gpt_limiter.on_success()
                     result = await response.json()
+                    if 'result' in result:
+                        await gpt_cache.set(cache_key, result)
                     return result
-        except Exception as e:
-            return {"error": f"Ошибка запроса: {str(e)}"}
-    return {"error": "Превышено количество попыток"}
+            except Exception as e:
+                GPT_ATTEMPTS.labels('exception').inc()
+                deadline = current_deadline()
+                if deadline is not None and deadline.expired():
+                    # таймаут попытки был урезан до дедлайна
+                    raise DeadlineExceeded() from e
+                call.outcome = 'error'
+                return {"error": f"Ошибка запроса: {str(e)}"}
+        call.outcome = 'retries_exhausted'
+        return {"error": "Превышено количество попыток"}
+
+async def read_limited(response, max_bytes: int):
+    """
+    Читает тело ответа, но не больше `max_bytes` байт.
+    """
+    chunks = []
+    size = 0
+    async for chunk in response.content.iter_chunked(64 * 1024):
+        chunks.append(chunk)
+        size += len(chunk)
+        if size >= max_bytes:
+            break
+    return b''.join(chunks)[:max_bytes]
+
+async def run_in_extract_pool(job):
+    """
+    Выполняет CPU-задачу (разбор HTML, ранжирование фрагментов) в пуле процессов,
+    а если пул отключен или сломан — в потоке.
+    """
+    pool = get_extract_pool()
+    if pool is None:
+        return await asyncio.to_thread(job)
+    try:
+        return await asyncio.get_running_loop().run_in_executor(pool, job)
+    except BrokenProcessPool:
+        # процесс пула упал: пересоздадим пул при следующем вызове, а эту страницу разберем в потоке
+        logger.info('Пул процессов разбора HTML сломан, пересоздаем')
+        close_extract_pool()
+        return await asyncio.to_thread(job)
+
+async def run_extraction(content: bytes, encoding: str = None):
+    """
+    Извлекает основной текст из HTML в пуле процессов, чтобы разбор не занимал цикл событий.
+
+    Аргументы:
+        content (bytes): HTML-контент страницы.
+        encoding (str, optional): Кодировка из заголовков ответа.
 
-def extract_main_text(url):
+    Возвращает:
+        str: Основной текст страницы или "Нет".
+    """
+    if extractor == 'bs4':
+        job = partial(parse_main_text, content)
+    else:
+        job = partial(extract_main_text_fast, content, page_text_chars, encoding)
+    return await run_in_extract_pool(job)
+
+async def extract_main_text(url):
     """
     Извлекает основной текст с веб-страницы по заданному URL.
 
-    Функция отправляет GET-запрос по указанному URL, парсит HTML-контент страницы 
-    с помощью BeautifulSoup и пытается извлечь текст из различных тегов, таких как:
-    <article>, <main>, или <p>.
+    Функция асинхронно загружает страницу (не больше FETCH_MAX_BYTES байт)
+    и разбирает её в пуле процессов, чтобы не блокировать цикл событий.
 
     Аргументы:
         url (str): URL страницы, с которой нужно извлечь текст.
@@ -153,43 +480,761 @@ def extract_main_text(url):
             - В случае ошибки при загрузке страницы возвращается сообщение вида: 
               "Ошибка при загрузке страницы: <код ошибки>".
     """
+    with external_call('page', url=url) as call:
+        # текст зависит от экстрактора и лимита, поэтому после их смены старые записи не используются
+        cache_key = f'{extractor}:{page_text_chars}:{normalize_url(url)}'
+        cached = await page_cache.get(cache_key)
+        if cached is not None:
+            call.outcome = 'cache'
+            return cached
+
+        try:
+            session = get_http_session()
+            timeout = aiohttp.ClientTimeout(total=budget(fetch_timeout), sock_connect=http_connect_timeout)
+            async with session.get(url, timeout=timeout) as response:
+                if response.status != 200:
+                    call.outcome = 'http_error'
+                    return f"Ошибка при загрузке страницы: {response.status}"
+                content = await read_limited(response, fetch_max_bytes)
+                encoding = response.charset
+        except Exception:
+            call.outcome = 'error'
+            return "Нет"
+
+        main_text = await run_extraction(content, encoding)
+        await page_cache.set(cache_key, main_text)
+        if main_text == 'Нет':
+            call.outcome = 'no_text'
+        return main_text
+
+class FetchLimiter:
+    """
+    Ограничивает число одновременных загрузок страниц: всего по процессу и на каждый хост.
+
+    Семафоры создаются лениво, уже внутри работающего цикла событий.
+    Семафор хоста удаляется, когда с этим хостом больше никто не работает.
+
+    Attributes:
+        total (int): Максимум одновременных загрузок.
+        per_host (int): Максимум одновременных загрузок с одного хоста.
+    """
+    def __init__(self, total: int, per_host: int):
+        self.total = total
+        self.per_host = per_host
+        self._total_semaphore = None
+        self._hosts = {}  # хост -> [семафор, число пользователей]
+
+    @asynccontextmanager
+    async def slot(self, url: str):
+        if self._total_semaphore is None:
+            self._total_semaphore = asyncio.Semaphore(self.total)
+        host = urlsplit(url).hostname or ''
+        entry = self._hosts.setdefault(host, [asyncio.Semaphore(self.per_host), 0])
+        entry[1] += 1
+        try:
+            async with entry[0], self._total_semaphore:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._hosts[host]
+
+fetch_limiter = FetchLimiter(fetch_concurrency, fetch_per_host)
+
+async def fetch_source_text(url: str, query: str):
+    """
+    Загружает и извлекает текст источника с учетом ограничений на параллельность, таймаута и дедлайна запроса.
+
+    Из текста остаются только лучшие по BM25 фрагменты (см. passages.py) в пределах SOURCE_TOKEN_BUDGET токенов.
+
+    Аргументы:
+        url (str): URL источника.
+        query (str): Вопрос вместе с вариантами ответа, по нему ранжируются фрагменты.
+
+    Возвращает:
+        str или None: Выбранные фрагменты основного текста или None, если текст получить не удалось.
+    """
+    async def fetch():
+        async with fetch_limiter.slot(url):
+            return await extract_main_text(url)
+
+    try:
+        # ожидание слота FetchLimiter тоже входит в таймаут загрузки
+        timeout = budget(fetch_timeout)
+        main_text = await asyncio.wait_for(fetch(), timeout)
+    except asyncio.TimeoutError:
+        logger.info(f'Источник {url} не загрузился за {timeout:.1f} сек.')
+        return None
+    except DeadlineExceeded:
+        return None
+    if main_text == 'Нет' or main_text.startswith('Ошибка при загрузке страницы'):
+        return None
+    # оставляем из текста сайта фрагменты, относящиеся к вопросу
+    job = partial(select_passages, main_text[:page_text_chars], query, source_token_budget, passage_chars)
+    passages = await run_in_extract_pool(job)
+    # пустой текст (например, пустой <article>) не отправляем на проверку полезности
+    return passages or None
+
+async def is_useful_source(question: str, main_text: str):
+    """
+    Спрашивает у модели, полезна ли информация источника для ответа на вопрос.
+
+    Аргументы:
+        question (str): Вопрос без вариантов ответа.
+        main_text (str): Текст источника.
+
+    Возвращает:
+        bool: True, если модель ответила "Да, полезна".
+    """
+    query = f'''Есть вопрос: {question}. Полезна ли следующая информация для ответа на поставленный вопрос вопрос? В ответ напиши "Да, полезна", если информация полезна и "Нет", если не полезна.
+    Информация: {main_text}
+    '''
+    yandex_gpt_response = await yandex_gpt(query, priority_filter)
+    try:
+        answer = yandex_gpt_response['result']['alternatives'][0]['message']['text']
+    except (KeyError, IndexError, TypeError):
+        logger.info(f'Не удалось разобрать ответ модели о полезности: {yandex_gpt_response}')
+        return False
+    return answer == 'Да, полезна'
+
+async def fetch_source_texts(urls, query: str, fetched: dict, limit: int = None):
+    """
+    Параллельно загружает тексты источников, но не дольше, чем до дедлайна запроса.
+
+    Аргументы:
+        urls (list): Список кортежей (заголовок, URL, сниппет) в порядке выдачи.
+        query (str): Вопрос вместе с вариантами ответа (для отбора фрагментов текста).
+        fetched (dict): Куда складывать загруженные тексты: позиция в выдаче -> (URL, текст).
+        limit (int, optional): Остановиться, как только загружено столько текстов.
+    """
+    async def fetch(rank, source_url):
+        main_text = await fetch_source_text(source_url, query)
+        if main_text is not None:
+            fetched[rank] = (source_url, main_text)
+
+    tasks = [asyncio.create_task(fetch(rank, source_url)) for rank, (_, source_url, _) in enumerate(urls)]
+    try:
+        for next_done in asyncio.as_completed(tasks, timeout=time_left()):
+            await next_done
+            if limit is not None and len(fetched) >= limit:
+                break
+    except asyncio.TimeoutError:
+        logger.info(f'До дедлайна загружено {len(fetched)} из {len(urls)} источников')
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+async def select_sources(urls, question: str, query: str, limit: int = max_sources, fetched: dict = None):
+    """
+    Параллельно загружает источники и отбирает полезные с помощью модели.
+
+    Все страницы загружаются одновременно (с ограничениями FetchLimiter), и каждый
+    текст сразу по готовности отправляется на проверку полезности. Как только
+    набралось `limit` полезных источников, оставшаяся работа отменяется.
+    При наступлении дедлайна возвращается то, что успели отобрать.
+
+    Аргументы:
+        urls (list): Список кортежей (заголовок, URL, сниппет) в порядке выдачи.
+        question (str): Вопрос без вариантов ответа.
+        query (str): Вопрос вместе с вариантами ответа (для отбора фрагментов текста).
+        limit (int): Сколько полезных источников нужно.
+        fetched (dict, optional): Куда складывать загруженные тексты, которые модель
+            не отвергла: позиция в выдаче -> (URL, текст).
+
+    Возвращает:
+        tuple: (sources, main_texts) — URL полезных источников и их тексты в порядке выдачи.
+    """
+    fetched = {} if fetched is None else fetched
+
+    async def check(rank, source_url):
+        main_text = await fetch_source_text(source_url, query)
+        if main_text is None:
+            return rank, source_url, None
+        fetched[rank] = (source_url, main_text)
+        try:
+            useful = await is_useful_source(question, main_text)
+        except DeadlineExceeded:
+            return rank, source_url, None
+        if not useful:
+            del fetched[rank]
+            return rank, source_url, None
+        return rank, source_url, main_text
+
+    tasks = [asyncio.create_task(check(rank, source_url)) for rank, (_, source_url, _) in enumerate(urls)]
+    found = []
     try:
-        response = requests.get(url)
-    except:
-        return "Нет"
-    
-    if response.status_code != 200:
-        return f"Ошибка при загрузке страницы: {response.status_code}"
-
-    # Парсим HTML-страницу
-    soup = BeautifulSoup(response.content, 'html.parser')
-
-    # Попробуем найти текст из различных типов тегов
-    # 1. Ищем в <article> (часто используется для основной статьи)
-    article = soup.find('article')
-    if article:
-        return article.get_text(separator=' ', strip=True)
-
-    # 2. Ищем в <main> (некоторые страницы используют это как основной блок контента)
-    main = soup.find('main')
-    if main:
-        return main.get_text(separator=' ', strip=True)
-
-    # 3. Ищем в теге <p> (параграфы могут содержать основную информацию)
-    paragraphs = soup.find_all('p')
-    if paragraphs:
-        return ' '.join([p.get_text(strip=True) for p in paragraphs])
-
-    # 4. Если ничего не нашли, возвращаем ошибку
-    return "Нет"
+        for next_done in asyncio.as_completed(tasks, timeout=time_left()):
+            rank, source_url, main_text = await next_done
+            # если полезна, сохраняем источник и текст
+            if main_text is not None:
+                found.append((rank, source_url, main_text))
+                if len(found) == limit:
+                    break
+    except asyncio.TimeoutError:
+        logger.info(f'До дедлайна отобрано {len(found)} полезных источников из {limit}: {question[:20]}')
+    finally:
+        # полезных источников достаточно, остальные загрузки и проверки не нужны
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    found.sort()
+    sources = [source_url for _, source_url, _ in found]
+    main_texts = [main_text for _, _, main_text in found]
+    return sources, main_texts
+
+def parse_relevance_verdict(text: str, count: int):
+    """
+    Разбирает ответ модели на пакетную проверку полезности.
+
+    Ожидается JSON-список номеров полезных источников, например "[1, 3]".
+
+    Аргументы:
+        text (str): Текст ответа модели.
+        count (int): Сколько источников было в промпте.
+
+    Возвращает:
+        set или None: Индексы (с нуля) полезных источников или None, если ответ не удалось разобрать.
+    """
+    match = re.search(r'\[[^\[\]]*\]', text)
+    if not match:
+        return None
+    try:
+        numbers = json.loads(match.group(0))
+    except ValueError:
+        return None
+    if not all(isinstance(n, int) and not isinstance(n, bool) and 1 <= n <= count for n in numbers):
+        return None
+    return {n - 1 for n in numbers}
+
+async def judge_sources_batch(question: str, main_texts):
+    """
+    Проверяет полезность нескольких источников одним вызовом GPT.
+
+    Если ответ модели не удалось разобрать, каждый источник проверяется
+    отдельно через is_useful_source.
+
+    Аргументы:
+        question (str): Вопрос без вариантов ответа.
+        main_texts (list of str): Тексты источников.
+
+    Возвращает:
+        list of bool: Вердикт по каждому источнику в том же порядке.
+    """
+    # укорачиваем по фрагментам, чтобы не отрезать лучшие из них вместе с концом текста
+    blocks = '\n'.join(
+        f'Источник {number}: {trim_passages(main_text, question, relevance_batch_chars, passage_chars)}'
+        for number, main_text in enumerate(main_texts, start=1)
+    )
+    query = f'''Есть вопрос: {question}. Ниже пронумерованы источники. Для каждого источника определи, полезна ли его информация для ответа на поставленный вопрос.
+    В ответ верни только JSON-список номеров полезных источников, например [1, 3]. Если полезных источников нет, верни [].
+    {blocks}
+    '''
+    yandex_gpt_response = await yandex_gpt(query, priority_filter)
+    try:
+        verdict = parse_relevance_verdict(
+            yandex_gpt_response['result']['alternatives'][0]['message']['text'], len(main_texts)
+        )
+    except (KeyError, IndexError, TypeError):
+        verdict = None
+
+    if verdict is None:
+        logger.info(f'Не удалось разобрать пакетный ответ о полезности, проверяем {len(main_texts)} источников по одному')
+        return list(await asyncio.gather(*(is_useful_source(question, main_text) for main_text in main_texts)))
+    return [index in verdict for index in range(len(main_texts))]
+
+async def select_sources_batched(urls, question: str, query: str, limit: int = max_sources, fetched: dict = None):
+    """
+    Отбирает полезные источники, проверяя их пачками по relevance_batch_size за один вызов GPT.
+
+    Если до дедлайна проверка не успела, полезных источников нет, а загруженные тексты остаются в `fetched`.
+
+    Аргументы:
+        urls (list): Список кортежей (заголовок, URL, сниппет) в порядке выдачи.
+        question (str): Вопрос без вариантов ответа.
+        query (str): Вопрос вместе с вариантами ответа (для отбора фрагментов текста).
+        limit (int): Сколько полезных источников нужно.
+        fetched (dict, optional): Куда складывать загруженные тексты, которые модель
+            не отвергла: позиция в выдаче -> (URL, текст).
+
+    Возвращает:
+        tuple: (sources, main_texts) — URL полезных источников и их тексты в порядке выдачи.
+    """
+    fetched = {} if fetched is None else fetched
+    await fetch_source_texts(urls, query, fetched)
+    candidates = [(rank, *fetched[rank]) for rank in sorted(fetched)]
+    batches = [candidates[i:i + relevance_batch_size] for i in range(0, len(candidates), relevance_batch_size)]
+    tasks = [
+        asyncio.create_task(judge_sources_batch(question, [main_text for _, _, main_text in batch]))
+        for batch in batches
+    ]
+    try:
+        verdicts = await asyncio.wait_for(asyncio.gather(*tasks), time_left())
+    except (asyncio.TimeoutError, DeadlineExceeded):
+        logger.info(f'До дедлайна не успели проверить полезность источников: {question[:20]}')
+        return [], []
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    selected = []
+    for batch, verdict in zip(batches, verdicts):
+        for (rank, source_url, main_text), useful in zip(batch, verdict):
+            if useful:
+                selected.append((source_url, main_text))
+            else:
+                del fetched[rank]
+    selected = selected[:limit]
+    sources = [source_url for source_url, _ in selected]
+    main_texts = [main_text for _, main_text in selected]
+    return sources, main_texts
+
+# строка варианта ответа: "1. ...", "1) ...", "1: ...", "1 - ..."
+option_line = re.compile(r'^\s*(\d+)\s*[.):\-–—](.*)$', re.MULTILINE)
+
+def parse_option_numbers(answers: str):
+    """
+    Находит номера вариантов ответа в блоке вида "1. ...\n2. ..." (см. option_line).
+
+    Аргументы:
+        answers (str): Варианты ответа.
+
+    Возвращает:
+        set of int: Номера вариантов.
+    """
+    return {int(number) for number, _ in option_line.findall(answers)}
+
+def parse_options(answers: str):
+    """
+    Разбирает варианты ответа из блока вида "1. ...\n2. ..." (см. option_line).
+
+    Аргументы:
+        answers (str): Варианты ответа.
+
+    Возвращает:
+        list of tuple: Пары (номер, текст варианта) в исходном порядке.
+    """
+    return [(int(number), text.strip()) for number, text in option_line.findall(answers)]
+
+def parse_final_answer(text: str, option_numbers):
+    """
+    Строго разбирает ответ модели вида {"answer": <номер или null>, "reasoning": "..."}.
+
+    Аргументы:
+        text (str): Текст ответа модели (JSON может быть обернут в ```).
+        option_numbers (set of int): Допустимые номера ответа; пустое множество — вариантов нет.
+
+    Возвращает:
+        tuple или None: (answer, reasoning) или None, если ответ не прошел проверку.
+    """
+    match = re.search(r'\{.*\}', text, re.DOTALL)
+    if not match:
+        return None
+    try:
+        parsed = json.loads(match.group(0))
+    except ValueError:
+        return None
+    if not isinstance(parsed, dict):
+        return None
+
+    reasoning = parsed.get('reasoning')
+    if not isinstance(reasoning, str) or not reasoning.strip():
+        return None
+    if not option_numbers:
+        return 'null', reasoning.strip()
+
+    answer = parsed.get('answer')
+    if isinstance(answer, str) and answer.strip().isdigit():
+        answer = int(answer)
+    if not isinstance(answer, int) or isinstance(answer, bool) or answer not in option_numbers:
+        return None
+    return answer, reasoning.strip()
+
+def format_sources(main_texts):
+    """
+    Собирает тексты источников для промпта: по источнику на строку, без экранирования, которое дает str(list).
+    """
+    return '\n'.join(f'Источник {number}: {main_text}' for number, main_text in enumerate(main_texts, start=1))
+
+async def answer_question_two_calls(question: str, answers: str, main_texts):
+    """
+    Прежний финальный этап: номер ответа и пояснение запрашиваются двумя отдельными вызовами GPT.
+
+    Возвращает:
+        tuple: (answer, reasoning).
+    """
+    # если ответов нет, то возвращаем null в answer поле
+    if answers == 'В данном вопросе нет вариантов ответа':
+        ans = 'null'
+    else: # в ином случае узнаем ответ у гпт
+        query = f'''Есть вопрос: {question}. Есть ответы: {answers}. Ответь на вопрос, выбрав один из вариантов: от "1", "2", до "10". Ни больше ни меньше\n
+        В качестве ответа верни ровно 1 число из набора, ни словом больше.\n
+        Дополнительная информация: {format_sources(main_texts)}\n
+        Ответь на вопрос, не добавляя ссылки. Мне нужно только текстовое объяснение, без перенаправлений на другие сайты.'''
+        yandex_gpt_response = await yandex_gpt(query)
+        ans = yandex_gpt_response['result']['alternatives'][0]['message']['text']
+
+    # отдельно просим у гпт пояснения к ответу
+    query = f'''Есть вопрос: {question}. Есть ответы: {answers}. Ответь на вопрос, выбрав один из вариантов: от "1", "2", до "10"\n
+    В качестве ответа верни цифру и Твое объяснение выбора, предпочтительно с цитатой из дополнительной информации (максимум 50 слов) \n
+    Дополнительная информация: {format_sources(main_texts)}\n 
+    Ответь на вопрос, не добавляя ссылки. Мне нужно только текстовое объяснение, без перенаправлений на другие сайты.
+    '''
+    yandex_gpt_response = await yandex_gpt(query)
+    reason = yandex_gpt_response['result']['alternatives'][0]['message']['text']
+    if reason[0] in '1234567890':
+        if reason[0] != ans:
+            logger.info(f'Ответ модели {ans} заменен на {reason[0]} из пояснения')
+            ans = int(reason[0])
+    return ans, reason
+
+async def answer_question(question: str, answers: str, main_texts):
+    """
+    Получает у модели ответ и пояснение одним вызовом в формате JSON.
+
+    Номер ответа проверяется по вариантам из `answers`. Если ответ модели
+    не удалось разобрать, используется прежний вариант с двумя вызовами.
+
+    Аргументы:
+        question (str): Вопрос без вариантов ответа.
+        answers (str): Варианты ответа или 'В данном вопросе нет вариантов ответа'.
+        main_texts (list of str): Тексты полезных источников.
+
+    Возвращает:
+        tuple: (answer, reasoning) — номер ответа ('null', если вариантов нет) и пояснение.
+    """
+    if answers == 'В данном вопросе нет вариантов ответа':
+        option_numbers = set()
+        query = f'''Есть вопрос: {question}. Ответь на вопрос и объясни ответ, предпочтительно с цитатой из дополнительной информации (максимум 50 слов).
+        Верни ответ строго в формате JSON, без текста вне него: {{"answer": null, "reasoning": "<ответ и объяснение>"}}\n
+        Дополнительная информация: {format_sources(main_texts)}\n
+        Ответь на вопрос, не добавляя ссылки. Мне нужно только текстовое объяснение, без перенаправлений на другие сайты.'''
+    else:
+        # номера не распознались — принимаем любой от 1 до 10, как и прежний промпт
+        option_numbers = parse_option_numbers(answers) or set(range(1, 11))
+        query = f'''Есть вопрос: {question}. Есть ответы: {answers}. Ответь на вопрос, выбрав ровно один из вариантов.
+        Верни ответ строго в формате JSON, без текста вне него: {{"answer": <номер выбранного варианта>, "reasoning": "<объяснение выбора, предпочтительно с цитатой из дополнительной информации (максимум 50 слов)>"}}\n
+        Дополнительная информация: {format_sources(main_texts)}\n
+        Ответь на вопрос, не добавляя ссылки. Мне нужно только текстовое объяснение, без перенаправлений на другие сайты.'''
+
+    yandex_gpt_response = await yandex_gpt(query)
+    try:
+        parsed = parse_final_answer(yandex_gpt_response['result']['alternatives'][0]['message']['text'], option_numbers)
+    except (KeyError, IndexError, TypeError):
+        parsed = None
+    if parsed is None:
+        logger.info(f'Не удалось разобрать ответ модели в формате JSON, спрашиваем ответ и пояснение отдельно: {question[:20]}')
+        return await answer_question_two_calls(question, answers, main_texts)
+    return parsed
+
+@app.get("/api/cache/stats")
+async def cache_stats():
+    """
+    Возвращает счетчики попаданий и промахов кешей поиска, страниц и GPT и индекса похожих вопросов.
+    """
+    stats = {cache.name: cache.stats() for cache in (search_cache, page_cache, gpt_cache)}
+    if similar_questions is not None:
+        stats[similar_questions.name] = similar_questions.stats()
+    return stats
+
+@app.get("/api/gpt/stats")
+async def gpt_stats():
+    """
+    Возвращает состояние ограничителя запросов к GPT: скорость, глубину очереди и время ожидания.
+    """
+    return gpt_limiter.stats()
+
+def answer_reserve():
+    """
+    Сколько секунд до дедлайна оставлять на финальный ответ: DEADLINE_ANSWER_RESERVE,
+    но не больше половины времени, отведенного на запрос (короткий X-Request-Deadline).
+    """
+    deadline = current_deadline()
+    if deadline is None or deadline.seconds is None:
+        return deadline_answer_reserve
+    return min(deadline_answer_reserve, deadline.seconds / 2)
+
+async def select_sources_by_deadline(urls, question: str, query: str, degradations: list, reserve: float):
+    """
+    Отбирает источники так, чтобы до дедлайна запроса осталось `reserve` секунд на ответ.
+
+    Если времени не хватает, отбор деградирует по шагам (шаги добавляются в degradations):
+        - fewer_sources: полезных источников меньше max_sources — остальные не успели проверить;
+        - no_relevance_filter: тексты источников берутся без проверки полезности — на неё
+          не хватило времени (меньше DEADLINE_FILTER_MIN секунд) или она не успела закончиться;
+        - snippets_only: не успели загрузить ни одной страницы, ответ строится по сниппетам выдачи.
+
+    Аргументы:
+        urls (list): Список кортежей (заголовок, URL, сниппет) в порядке выдачи.
+        question (str): Вопрос без вариантов ответа.
+        query (str): Вопрос вместе с вариантами ответа (для отбора фрагментов текста).
+        degradations (list of str): Куда добавлять примененные шаги деградации.
+        reserve (float): Сколько секунд оставить на финальный ответ (см. answer_reserve).
+
+    Возвращает:
+        tuple: (sources, main_texts) — URL источников и их тексты (или сниппеты).
+    """
+    if not urls:
+        return [], []
+
+    fetched = {}
+    sources, main_texts = [], []
+    with deadline_scope(reserve) as scope:
+        left = time_left()
+        filtered = left is None or left >= deadline_filter_min
+        if filtered:
+            select = select_sources_batched if relevance_mode == 'batch' else select_sources
+            sources, main_texts = await select(urls, question, query, fetched=fetched)
+        elif left > 0:
+            await fetch_source_texts(urls, query, fetched, max_sources)
+    if filtered and (scope is None or not scope.expired()):
+        return sources, main_texts
+
+    if sources:
+        if len(sources) < max_sources:
+            degradations.append('fewer_sources')
+        return sources, main_texts
+    if fetched:
+        degradations.append('no_relevance_filter')
+        ranks = sorted(fetched)[:max_sources]
+        return [fetched[rank][0] for rank in ranks], [fetched[rank][1] for rank in ranks]
+    degradations.append('snippets_only')
+    top = urls[:max_sources]
+    return [url for _, url, _ in top], [snippet or title for title, _, snippet in top]
+
+async def run_pipeline(big_question: str):
+    """
+    Полный цикл ответа на вопрос: поиск, отбор источников и финальный ответ Yandex GPT.
+
+    Если похожий вопрос уже обрабатывался (см. similar_questions.py), поиск и отбор источников
+    пропускаются, а если это тот же вопрос (те же слова и варианты), переиспользуется и сам ответ.
+
+    Этапы укладываются в дедлайн запроса, если он задан: при нехватке времени
+    отбор источников упрощается (см. select_sources_by_deadline), а если поиск не успел
+    (no_search), модель отвечает без источников.
+
+    Аргументы:
+        big_question (str): Вопрос вместе с вариантами ответа (если они есть).
+
+    Возвращает:
+        dict: Поля ответа без id:
+            - answer (str or int): Номер ответа или 'null', если вариантов ответа нет.
+            - reasoning (str): Объяснение выбора ответа.
+            - sources (list of str): Использованные источники.
+            - degradations (list of str): Какие упрощения пришлось применить, чтобы успеть к дедлайну.
+
+    Исключения:
+        DeadlineExceeded: Если финальный ответ не получен до дедлайна.
+    """
+    try: # попробуем разделить вопрос и ответ
+        question, answers = re.split(r'(?=\n1)', big_question, maxsplit=1)
+        answers = answers.lstrip('\n')
+    except: # если не получилось, считаем что ответов нет
+        question, answers = big_question, 'В данном вопросе нет вариантов ответа'
+
+    options = parse_options(answers)
+    degradations = []
+    reserve = answer_reserve()
+
+    # такой же вопрос (возможно, в другой формулировке или с другим порядком вариантов) уже обрабатывали?
+    similar = None
+    if similar_questions is not None:
+        with stage('similar') as span:
+            similar = similar_questions.find(question, options)
+            span.outcome = 'miss' if similar is None else 'hit'
+
+    if similar is not None:
+        sources, main_texts = similar['sources'], similar['main_texts']
+        ans = remap_answer(similar, question, options)
+        if ans is not None:
+            logger.info(f'Запрос {question[:20]} похож на уже обработанный ({similar["score"]:.2f}), берем его ответ')
+            return {
+                "answer": ans,
+                "reasoning": similar['reasoning'] + '\nОтвет сгенерирован с помощью YandexGPT',
+                "sources": sources,
+                "degradations": degradations
+            }
+        logger.info(f'Запрос {question[:20]} похож на уже обработанный ({similar["score"]:.2f}), берем его источники')
+    else:
+        # ищем в поисковике весь запрос и вопрос из запроса для большей вероятности поймать хорошие источники
+        with stage('search'), deadline_scope(reserve) as scope:
+            urls = await search_sources(big_question, question)
+        if not urls and scope is not None and scope.expired():
+            degradations.append('no_search')
+
+        # Полезны ли эти источники? Давайте фильтровать
+        with stage('select_sources', mode=relevance_mode, candidates=len(urls)) as span:
+            sources, main_texts = await select_sources_by_deadline(urls, question, big_question, degradations, reserve)
+            if degradations:
+                span.attrs['degradations'] = degradations
+
+    # получаем у гпт ответ вместе с пояснением
+    with stage('answer', sources=len(sources)):
+        ans, reason = await answer_question(question, answers, main_texts)
+
+    # запоминаем полноценный ответ (без деградаций и с источниками) для похожих вопросов
+    if similar_questions is not None and sources and not degradations:
+        await similar_questions.add(question, options, {
+            "answer": ans, "reasoning": reason, "sources": sources, "main_texts": main_texts
+        })
+
+    return {
+        "answer": ans,
+        "reasoning": reason + '\nОтвет сгенерирован с помощью YandexGPT',
+        "sources": sources,
+        "degradations": degradations
+    }
+
+inflight_queries = {}  # текст запроса -> (задача с его обработкой, её дедлайн)
+
+async def process_query(big_question: str):
+    """
+    Запускает run_pipeline, объединяя одинаковые одновременные запросы в один прогон.
+
+    Если такой же вопрос уже обрабатывается с дедлайном не позже нашего, ждем его результат
+    вместо нового прогона; прогон с более поздним дедлайном мог бы не уложиться в наш.
+    Общая задача защищена от отмены: отключение одного клиента не прерывает ответ остальным.
+
+    Аргументы:
+        big_question (str): Вопрос вместе с вариантами ответа (если они есть).
+
+    Возвращает:
+        dict: Результат run_pipeline.
+    """
+    deadline = current_deadline()
+    task, task_deadline = inflight_queries.get(big_question, (None, None))
+    if task is not None and (
+        deadline is None or (task_deadline is not None and task_deadline.expires_at <= deadline.expires_at)
+    ):
+        logger.info(f'Запрос {big_question[:20]} уже обрабатывается, ждем его результат')
+    else:
+        # задача наследует контекст, а с ним и дедлайн этого запроса
+        task = asyncio.create_task(run_pipeline(big_question))
+        inflight_queries[big_question] = (task, deadline)
+
+        def forget(done_task):
+            if inflight_queries.get(big_question, (None,))[0] is done_task:
+                del inflight_queries[big_question]
+
+        task.add_done_callback(forget)
+    return await asyncio.shield(task)
+
+def error_detail(error: Exception):
+    """
+    Текст ошибки обработки запроса в том виде, в каком он возвращается клиенту.
+    """
+    if isinstance(error, DeadlineExceeded):
+        return "Deadline exceeded"
+    if isinstance(error, KeyError):
+        return "Error parsing Yandex GPT response"
+    return f"Internal server error: {str(error)}"
+
+def start_deadline(header_value: Optional[float]):
+    """
+    Задает дедлайн запроса: из заголовка X-Request-Deadline (в секундах) или REQUEST_DEADLINE.
+
+    Возвращает:
+        Token или None: Токен для reset_deadline или None, если дедлайна нет.
+    """
+    seconds = header_value or request_deadline
+    return set_deadline(seconds) if seconds > 0 else None
+
+def parse_batch_body(body: bytes):
+    """
+    Разбирает тело /api/batch: JSON-список объектов QueryRequest или JSONL (по объекту на строку).
+
+    Аргументы:
+        body (bytes): Тело запроса.
+
+    Возвращает:
+        list of QueryRequest: Запросы в исходном порядке.
+
+    Исключения:
+        HTTPException: 422, если тело не удалось разобрать.
+    """
+    try:
+        items = json.loads(body)
+        if not isinstance(items, list):
+            items = [items]
+    except ValueError:
+        try:
+            items = [json.loads(line) for line in body.decode('utf-8').splitlines() if line.strip()]
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=f"Invalid JSONL body: {str(e)}")
+    try:
+        return [QueryRequest(**item) for item in items]
+    except (TypeError, ValidationError) as e:
+        raise HTTPException(status_code=422, detail=f"Invalid batch item: {str(e)}")
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Отдает метрики в формате Prometheus: время этапов и внешних вызовов, попытки и 429 от GPT, состояние ограничителя.
+    """
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.post("/api/batch")
+async def handle_batch(request: Request, x_request_deadline: Optional[float] = Header(None, gt=0)):
+    """
+    Обрабатывает пачку вопросов и возвращает результаты потоком NDJSON по мере готовности.
+
+    Тело — JSON-список объектов {id, query} или JSONL с таким объектом на каждой строке.
+    Одновременно обрабатывается не больше BATCH_CONCURRENCY разных вопросов;
+    одинаковые вопросы обрабатываются один раз. Дедлайн (X-Request-Deadline или REQUEST_DEADLINE)
+    отсчитывается для каждого вопроса с начала его обработки.
+
+    Возвращает:
+        StreamingResponse: По строке JSON на каждый запрос — в формате ответа /api/request
+        либо {"id": ..., "error": ...}, если запрос обработать не удалось.
+    """
+    items = parse_batch_body(await request.body())
+    # одинаковые вопросы внутри пачки обрабатываем один раз
+    ids_by_query = {}
+    for item in items:
+        ids_by_query.setdefault(item.query, []).append(item.id)
+
+    semaphore = asyncio.Semaphore(batch_concurrency)
+
+    async def run_one(query):
+        async with semaphore:
+            # у каждого вопроса своя задача, поэтому дедлайн не нужно сбрасывать
+            start_deadline(x_request_deadline)
+            trace = start_trace(ids_by_query[query]) if trace_log else None
+            try:
+                with stage('request'):
+                    result = await process_query(query)
+            except Exception as e:
+                result, error = None, error_detail(e)
+            else:
+                error = None
+            if trace is not None:
+                finish_trace(trace, error=error)
+            return query, result, error
+
+    async def stream():
+        tasks = [asyncio.create_task(run_one(query)) for query in ids_by_query]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                query, result, error = await next_done
+                for request_id in ids_by_query[query]:
+                    line = {"id": request_id, **result} if error is None else {"id": request_id, "error": error}
+                    yield json.dumps(line, ensure_ascii=False) + '\n'
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream(), media_type='application/x-ndjson')
 
 @app.post("/api/request")
-async def handle_request(request: QueryRequest):
+async def handle_request(request: QueryRequest, x_request_deadline: Optional[float] = Header(None, gt=0)):
     """
     Обрабатывает запрос от клиента, выполняет поиск и анализирует источники для ответа на вопрос с помощью Yandex GPT.
 
     Аргументы:
         request (QueryRequest): Структура данных, содержащая идентификатор запроса и сам текст запроса.
+        x_request_deadline (float, optional): Заголовок X-Request-Deadline — за сколько секунд нужно
+            ответить; по умолчанию REQUEST_DEADLINE. Если ответ не успел, возвращается 504.
 
     Возвращает:
         JSONResponse: Ответ в формате JSON с полями:
@@ -197,104 +1242,30 @@ async def handle_request(request: QueryRequest):
             - answer (str or None): Ответ на вопрос или None, если вариантов ответа нет.
             - reasoning (str): Объяснение выбора ответа, предпочтительно с цитатой из текста источников.
             - sources (list of str): Список источников, которые были использованы для получения информации.
+            - degradations (list of str): Упрощения, примененные, чтобы уложиться в дедлайн.
     """
-    try: 
-        sources = [] # хорошие источники 
-        main_texts = [] # текст с хороших источников
-        checked_sites = []  # ссылки, которые уже были проанализированы
-        counter = 0 # счетчик для ограничения источников до 3
-        big_question = request.query # сохраним в отдельной переменной весь запрос
-        try: # попробуем разделить вопрос и ответ
-            question, answers = re.split(r'(?=\n1)', big_question, maxsplit=1)
-            answers = answers.lstrip('\n')
-        except: # если не получилось, считаем что ответов нет
-            question, answers = big_question, 'В данном вопросе нет вариантов ответа'
-
-        # ищем в поисковике весь запрос и вопрос из запроса для большей вероятности поймать хорошие источники
-        urls1 = yandex_search(big_question)
-        if urls1:
-            urls1 = urls1[:4]
-
-        urls2 = yandex_search(question)
-        if urls2:
-            urls2 = urls2[:4]
-        
-        if urls1 and urls2:
-            urls = list(chain(*zip(urls1, urls2)))
-        elif urls2:   
-            urls = urls2
-        elif urls1:
-            urls = urls1
-        else:
-            urls = []
-
-        if urls:
-            # Полезны ли эти источники? Давайте фильтровать
-            for _, source_url in urls:
-                # проверяем был ли уже этот источник проанализирован и сколько сейчас хороших источников
-                if counter == 3: 
-                    break
-                if source_url in checked_sites:
-                    continue
-                main_text = extract_main_text(source_url)[:2000] # извлекаем ключевой текст с ссайта
-                if main_text == 'Нет':
-                    break
-                # узнаем у модели полезна ли ей информация с этого источника
-                query = f'''Есть вопрос: {question}. Полезна ли следующая информация для ответа на поставленный вопрос вопрос? В ответ напиши "Да, полезна", если информация полезна и "Нет", если не полезна.
-                Информация: {main_text}
-                '''
-                yandex_gpt_response = await yandex_gpt(query)
-                yandex_gpt_response["result"]["alternatives"][0]["message"]["text"]
-
-                answer = yandex_gpt_response['result']['alternatives'][0]['message']['text']
-                
-                checked_sites.append(source_url)
-
-                # если полезна, сохраняем источник и текст
-                if answer == 'Да, полезна':
-                    sources.append(source_url)
-                    main_texts.append(main_text)
-                    counter += 1
-                else:
-                    pass
-        
-        # если ответов нет, то возвращаем null в answer поле
-        if answers == 'В данном вопросе нет вариантов ответа':
-            ans = 'null'
-        else: # в ином случае узнаем ответ у гпт
-            query = f'''Есть вопрос: {question}. Есть ответы: {answers}. Ответь на вопрос, выбрав один из вариантов: от "1", "2", до "10". Ни больше ни меньше\n
-            В качестве ответа верни ровно 1 число из набора, ни словом больше.\n
-            Дополнительная информация: {str(main_texts)}\n
-            Ответь на вопрос, не добавляя ссылки. Мне нужно только текстовое объяснение, без перенаправлений на другие сайты.'''
-            yandex_gpt_response = await yandex_gpt(query)
-            ans = yandex_gpt_response['result']['alternatives'][0]['message']['text']
-        
-        # отдельно просим у гпт пояснения к ответу
-        query = f'''Есть вопрос: {question}. Есть ответы: {answers}. Ответь на вопрос, выбрав один из вариантов: от "1", "2", до "10"\n
-        В качестве ответа верни цифру и Твое объяснение выбора, предпочтительно с цитатой из дополнительной информации (максимум 50 слов) \n
-        Дополнительная информация: {str(main_texts)}\n 
-        Ответь на вопрос, не добавляя ссылки. Мне нужно только текстовое объяснение, без перенаправлений на другие сайты.
-        '''
-        yandex_gpt_response = await yandex_gpt(query)
-        reason = yandex_gpt_response['result']['alternatives'][0]['message']['text']
-        if reason[0] in '1234567890':
-            if reason[0] != ans:
-                print(f'here! was {ans}, now {reason[0]}!')
-                ans = int(reason[0])
-       # Возвращаем ответ в формате JSON
-        return JSONResponse(
-            content={
-                "id": request.id,
-                "answer": ans,
-                "reasoning": reason + '\nОтвет сгенерирован с помощью YandexGPT',
-                "sources": sources
-            }
-        )
-
-    except KeyError:
-        raise HTTPException(status_code=500, detail="Error parsing Yandex GPT response")
+    deadline = start_deadline(x_request_deadline)
+    trace = start_trace(request.id) if trace_log else None
+    try:
+        with stage('request'):
+            result = await process_query(request.query)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+        if trace is not None:
+            finish_trace(trace, error=error_detail(e))
+        raise HTTPException(status_code=504 if isinstance(e, DeadlineExceeded) else 500, detail=error_detail(e))
+    finally:
+        if deadline is not None:
+            reset_deadline(deadline)
+    if trace is not None:
+        finish_trace(trace)
+
+    # Возвращаем ответ в формате JSON
+    return JSONResponse(
+        content={
+            "id": request.id,
+            **result
+        }
+    )
 
 
 # uvicorn main:app --host 127.0.0.1 --port 8080 --reload
\ No newline at end of file
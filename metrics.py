@@ -0,0 +1,153 @@
+"""
+Метрики Prometheus и трассировка обработки запроса.
+
+Этапы handle_request и внешние вызовы (поиск, загрузка страниц, GPT) замеряются
+контекстными менеджерами stage и external_call: время попадает в гистограммы,
+а если для запроса включена трассировка (start_trace), то еще и в его трассу,
+которая в конце пишется одной JSON-строкой в логгер "trace".
+"""
+import asyncio
+import json
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from prometheus_client import Counter, Gauge, Histogram
+
+from deadline import DeadlineExceeded
+
+trace_logger = logging.getLogger('trace')
+
+_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80, 160)
+
+STAGE_SECONDS = Histogram(
+    'ai_query_stage_seconds', 'Время этапов обработки запроса', ['stage'], buckets=_BUCKETS
+)
+EXTERNAL_CALL_SECONDS = Histogram(
+    'ai_query_external_call_seconds', 'Время внешних вызовов (поиск, страницы, GPT)', ['service', 'outcome'], buckets=_BUCKETS
+)
+GPT_ATTEMPTS = Counter(
+    'ai_query_gpt_attempts_total', 'HTTP-попытки запросов к Yandex GPT по статусу ответа', ['status']
+)
+GPT_RETRIES = Counter(
+    'ai_query_gpt_retries_total', 'Повторные попытки запросов к Yandex GPT'
+)
+GPT_LIMITER_WAIT_SECONDS = Histogram(
+    'ai_query_gpt_limiter_wait_seconds', 'Ожидание разрешения ограничителя запросов к GPT', ['priority'], buckets=_BUCKETS
+)
+GPT_LIMITER_RATE = Gauge(
+    'ai_query_gpt_limiter_rate', 'Текущая скорость ограничителя запросов к GPT (запросов в секунду)'
+)
+GPT_LIMITER_QUEUE_DEPTH = Gauge(
+    'ai_query_gpt_limiter_queue_depth', 'Число вызовов GPT в очереди ограничителя'
+)
+
+_trace = ContextVar('trace', default=None)
+
+
+class Span:
+    """
+    Замер одного этапа или внешнего вызова.
+
+    Attributes:
+        name (str): Имя этапа или сервиса.
+        outcome (str): Результат вызова (метка гистограммы): 'ok', 'cache', 'error' и т.п.
+        attrs (dict): Дополнительные поля для трассы.
+    """
+    def __init__(self, name: str, attrs: dict):
+        self.name = name
+        self.outcome = 'ok'
+        self.attrs = attrs
+        self.started = time.monotonic()
+
+
+def start_trace(request_id):
+    """
+    Включает трассировку для текущего контекста (запроса и порожденных им задач).
+
+    Аргументы:
+        request_id: Идентификатор запроса, по которому трасса попадет в лог.
+
+    Возвращает:
+        Token: Токен для finish_trace.
+    """
+    return _trace.set({'id': request_id, 'started': time.monotonic(), 'spans': []})
+
+def finish_trace(token, **fields):
+    """
+    Пишет трассу текущего запроса в логгер "trace" и выключает трассировку.
+
+    Аргументы:
+        token: Токен из start_trace.
+        **fields: Дополнительные поля записи (например, error).
+    """
+    trace = _trace.get()
+    _trace.reset(token)
+    if trace is None:
+        return
+    record = {
+        'id': trace['id'],
+        'duration': round(time.monotonic() - trace['started'], 4),
+        **fields,
+        'spans': trace['spans'],
+    }
+    trace_logger.info(json.dumps(record, ensure_ascii=False, default=str))
+
+def _record_span(span: Span, kind: str):
+    trace = _trace.get()
+    if trace is None:
+        return
+    trace['spans'].append({
+        'kind': kind,
+        'name': span.name,
+        'outcome': span.outcome,
+        'start': round(span.started - trace['started'], 4),
+        'duration': round(time.monotonic() - span.started, 4),
+        **span.attrs,
+    })
+
+@contextmanager
+def stage(name: str, **attrs):
+    """
+    Замеряет этап обработки запроса (гистограмма ai_query_stage_seconds).
+    """
+    span = Span(name, attrs)
+    try:
+        yield span
+    except asyncio.CancelledError:
+        span.outcome = 'cancelled'
+        raise
+    except DeadlineExceeded:
+        span.outcome = 'deadline'
+        raise
+    except BaseException:
+        span.outcome = 'error'
+        raise
+    finally:
+        STAGE_SECONDS.labels(name).observe(time.monotonic() - span.started)
+        _record_span(span, 'stage')
+
+@contextmanager
+def external_call(service: str, **attrs):
+    """
+    Замеряет внешний вызов (гистограмма ai_query_external_call_seconds).
+
+    Результат вызова задается через span.outcome; необработанное исключение — 'error', отмена — 'cancelled',
+    истекший дедлайн запроса — 'deadline'.
+    """
+    span = Span(service, attrs)
+    try:
+        yield span
+    except asyncio.CancelledError:
+        span.outcome = 'cancelled'
+        raise
+    except DeadlineExceeded:
+        span.outcome = 'deadline'
+        raise
+    except BaseException:
+        span.outcome = 'error'
+        raise
+    finally:
+        EXTERNAL_CALL_SECONDS.labels(service, span.outcome).observe(time.monotonic() - span.started)
+        _record_span(span, 'call')
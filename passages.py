@@ -0,0 +1,145 @@
+"""
+Отбор фрагментов текста страницы, которые лучше всего отвечают на вопрос.
+
+Текст страницы режется на фрагменты по границам предложений, фрагменты
+ранжируются по BM25 относительно вопроса и вариантов ответа, и в промпт
+идут лучшие из них, пока не исчерпан бюджет токенов. Подсчет BM25 векторизован
+в NumPy: матрица частот «фрагмент × слово запроса» строится одним bincount.
+"""
+import math
+import re
+
+import numpy as np
+
+_WORD = re.compile(r'\w+')
+_SENTENCE_END = re.compile(r'(?<=[.!?…])\s+')
+_STEM = 5  # слова сравниваются по первым буквам — грубая замена стемминга для русских окончаний
+_CHARS_PER_TOKEN = 4  # оценка длины токена Yandex GPT в символах
+_K1 = 1.5
+_B = 0.75
+
+
+def tokenize(text: str):
+    """
+    Разбивает текст на слова: нижний регистр, без однобуквенных слов, не длиннее _STEM символов.
+    """
+    return [word[:_STEM] for word in _WORD.findall(text.lower()) if len(word) > 1]
+
+def estimate_tokens(text: str):
+    """
+    Оценивает число токенов текста по его длине.
+    """
+    return math.ceil(len(text) / _CHARS_PER_TOKEN)
+
+def split_passages(text: str, max_chars: int):
+    """
+    Режет текст на фрагменты не длиннее `max_chars` символов, по возможности по границам предложений.
+
+    Аргументы:
+        text (str): Текст страницы.
+        max_chars (int): Максимальная длина фрагмента.
+
+    Возвращает:
+        list of str: Фрагменты в порядке следования в тексте.
+    """
+    passages = []
+    current = ''
+    for sentence in _SENTENCE_END.split(text):
+        # слишком длинное предложение режем по словам
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(' ', 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            if current:
+                passages.append(current)
+                current = ''
+            passages.append(sentence[:cut])
+            sentence = sentence[cut:].lstrip()
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            passages.append(current)
+            current = ''
+        current = f'{current} {sentence}' if current else sentence
+    if current:
+        passages.append(current)
+    return passages
+
+def bm25_scores(passages, query: str):
+    """
+    Считает BM25 каждого фрагмента относительно запроса; IDF — по фрагментам этого же текста.
+
+    Аргументы:
+        passages (list of str): Фрагменты текста.
+        query (str): Вопрос вместе с вариантами ответа.
+
+    Возвращает:
+        numpy.ndarray: Оценки фрагментов.
+    """
+    terms = {term: index for index, term in enumerate(dict.fromkeys(tokenize(query)))}
+    if not passages or not terms:
+        return np.zeros(len(passages))
+
+    tokens = [tokenize(passage) for passage in passages]
+    lengths = np.array([len(passage_tokens) for passage_tokens in tokens], dtype=float)
+    # индексы (фрагмент, слово запроса) для всех вхождений слов запроса
+    hits = [
+        number * len(terms) + terms[token]
+        for number, passage_tokens in enumerate(tokens)
+        for token in passage_tokens
+        if token in terms
+    ]
+    tf = np.bincount(np.array(hits, dtype=np.int64), minlength=len(passages) * len(terms))
+    tf = tf.reshape(len(passages), len(terms)).astype(float)
+
+    df = (tf > 0).sum(axis=0)
+    idf = np.log((len(passages) - df + 0.5) / (df + 0.5) + 1)
+    norm = _K1 * (1 - _B + _B * lengths / max(lengths.mean(), 1.0))
+    return (tf * (_K1 + 1) / (tf + norm[:, None])) @ idf
+
+def _select(text: str, query: str, passage_chars: int, budget: int, cost):
+    passages = split_passages(text, passage_chars)
+    scores = bm25_scores(passages, query)
+    chosen = []
+    used = 0
+    for index in np.argsort(-scores, kind='stable'):
+        price = cost(passages[index])
+        if used + price > budget:
+            continue
+        chosen.append(index)
+        used += price
+    # выбираем по оценке, а выводим в порядке текста, чтобы соседние предложения оставались рядом
+    return ' '.join(passages[index] for index in sorted(chosen))
+
+def select_passages(text: str, query: str, token_budget: int, passage_chars: int):
+    """
+    Оставляет от текста лучшие по BM25 фрагменты, укладываясь в бюджет токенов.
+
+    Фрагменты выбираются по убыванию оценки (при равных оценках — в порядке текста),
+    а в результат идут в порядке текста. Если ни одно слово запроса в тексте
+    не встретилось, остается начало текста, как при простой обрезке.
+
+    Аргументы:
+        text (str): Текст страницы.
+        query (str): Вопрос вместе с вариантами ответа.
+        token_budget (int): Сколько токенов можно потратить на текст.
+        passage_chars (int): Максимальная длина фрагмента в символах.
+
+    Возвращает:
+        str: Выбранные фрагменты через пробел.
+    """
+    return _select(text, query, passage_chars, token_budget, estimate_tokens)
+
+def trim_passages(text: str, query: str, max_chars: int, passage_chars: int):
+    """
+    Укорачивает текст до `max_chars` символов, отбрасывая худшие по BM25 фрагменты, а не хвост текста.
+
+    Аргументы:
+        text (str): Текст (обычно уже выбранные select_passages фрагменты).
+        query (str): Вопрос, по которому ранжируются фрагменты.
+        max_chars (int): Максимальная длина результата.
+        passage_chars (int): Максимальная длина фрагмента в символах.
+
+    Возвращает:
+        str: Фрагменты в порядке текста.
+    """
+    if len(text) <= max_chars:
+        return text
+    return _select(text, query, passage_chars, max_chars, lambda passage: len(passage) + 1) or text[:max_chars]
@@ -0,0 +1,144 @@
+"""
+Общий для процесса адаптивный ограничитель частоты запросов к Yandex GPT.
+
+Ограничитель — token bucket, скорость которого подстраивается по схеме AIMD:
+каждый успешный ответ немного увеличивает скорость, ответ 429 — уменьшает
+её вдвое. Вызовы, которым не хватило токена, ждут в очереди с приоритетами:
+меньшее число — более срочный вызов.
+"""
+import asyncio
+import heapq
+import itertools
+import time
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket с AIMD-подстройкой скорости и приоритетной очередью ожидания.
+
+    Attributes:
+        rate (float): Текущая скорость (запросов в секунду).
+        min_rate (float): Нижняя граница скорости.
+        max_rate (float): Верхняя граница скорости.
+        increase (float): На сколько запросов в секунду скорость растет примерно за секунду без 429.
+        decrease (float): Во сколько раз умножается скорость после 429.
+        burst (float): Емкость корзины — сколько запросов можно отправить разом.
+        cooldown (float): Не чаще какого интервала (в секундах) снижать скорость: пачка 429
+            от уже отправленных запросов не должна обрушить её до минимума.
+        priority_names (dict): Имена приоритетов для статистики.
+    """
+    def __init__(self, rate: float, min_rate: float, max_rate: float, increase: float,
+                 decrease: float = 0.5, burst: float = 5, cooldown: float = 1.0, priority_names: dict = None):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.burst = burst
+        self.cooldown = cooldown
+        self.priority_names = priority_names or {}
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._waiters = []  # куча из (приоритет, порядковый номер, future, момент постановки в очередь)
+        self._seq = itertools.count()
+        self._dispatcher = None
+        self._stats = {'throttled': 0, 'successes': 0}
+        self._waits = {}  # приоритет -> [число вызовов, суммарное ожидание, максимальное ожидание]
+
+    async def acquire(self, priority: int):
+        """
+        Ждет разрешения на один запрос.
+
+        Аргументы:
+            priority (int): Приоритет вызова, меньшее число обслуживается раньше.
+        """
+        now = self._refill()
+        if not self._waiters and self._tokens >= 1 and now >= self._paused_until:
+            self._tokens -= 1
+            self._record_wait(priority, 0.0)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future, now))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        try:
+            await future
+        except asyncio.CancelledError:
+            # токен уже выдан, но вызов отменили — возвращаем токен в корзину
+            if future.done() and not future.cancelled():
+                self._tokens = min(self.burst, self._tokens + 1)
+            raise
+
+    def on_success(self):
+        """
+        Аддитивное увеличение скорости после успешного ответа.
+        """
+        self._stats['successes'] += 1
+        self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    def on_throttled(self, retry_after: float = None):
+        """
+        Мультипликативное уменьшение скорости после ответа 429.
+
+        Аргументы:
+            retry_after (float, optional): Значение заголовка Retry-After — до этого момента
+                новые запросы не выдаются вовсе.
+        """
+        now = self._refill()
+        self._stats['throttled'] += 1
+        if now - self._last_decrease >= self.cooldown:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self._tokens = min(self._tokens, 0.0)
+            self._last_decrease = now
+        if retry_after:
+            self._paused_until = max(self._paused_until, now + retry_after)
+
+    def stats(self):
+        """
+        Возвращает текущую скорость, глубину очереди и время ожидания по приоритетам.
+        """
+        waits = {}
+        for priority, (count, total, longest) in sorted(self._waits.items()):
+            waits[self.priority_names.get(priority, str(priority))] = {
+                'calls': count,
+                'avg_wait': total / count if count else 0.0,
+                'max_wait': longest,
+            }
+        return {
+            'rate': self.rate,
+            'queue_depth': sum(1 for waiter in self._waiters if not waiter[2].done()),
+            **self._stats,
+            'waits': waits,
+        }
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        return now
+
+    def _record_wait(self, priority: int, wait: float):
+        entry = self._waits.setdefault(priority, [0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += wait
+        entry[2] = max(entry[2], wait)
+
+    async def _dispatch(self):
+        # выдаем токены ожидающим по приоритету, пока очередь не опустеет
+        while self._waiters:
+            priority, _, future, enqueued_at = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            now = self._refill()
+            delay = max(self._paused_until - now, (1 - self._tokens) / self.rate)
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            heapq.heappop(self._waiters)
+            self._tokens -= 1
+            self._record_wait(priority, now - enqueued_at)
+            future.set_result(None)
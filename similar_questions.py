@@ -0,0 +1,216 @@
+"""
+Индекс похожих вопросов: находит среди уже обработанных тот же вопрос
+с вариантами ответа в другом порядке или близкий к нему (см. remap_answer).
+
+Вопрос вместе с вариантами (варианты отсортированы, поэтому их порядок не важен)
+сводится к множеству символьных триграмм, а множество — к MinHash-сигнатуре.
+Доля совпавших позиций двух сигнатур оценивает коэффициент Жаккара их множеств
+триграмм, поэтому поиск по индексу — одно векторное сравнение сигнатуры запроса
+со всеми сигнатурами индекса в NumPy.
+"""
+import asyncio
+import json
+import logging
+import re
+import sqlite3
+import time
+
+import numpy as np
+
+from cache import SQLiteStore, normalize_query, prompt_key
+
+logger = logging.getLogger(__name__)
+
+_NGRAM = 3  # три символа по 21 биту помещаются в одно 64-битное число
+_CODE_BITS = np.uint64(21)
+_MIX = np.uint64(0x9E3779B97F4A7C15)
+_SHIFT = np.uint64(32)
+
+
+def normalize_option(text: str):
+    """
+    Приводит текст варианта ответа к виду для сравнения: нижний регистр, без пробелов и знаков по краям.
+    """
+    return normalize_query(text).strip(' .,;')
+
+def question_words(question: str):
+    """
+    Множество слов вопроса в нижнем регистре: вопросы с одинаковым множеством различаются разве что порядком слов.
+    """
+    return set(re.findall(r'\w+', question.lower()))
+
+def question_text(question: str, options):
+    """
+    Текст, по которому сравниваются вопросы: вопрос и отсортированные варианты ответа.
+
+    Аргументы:
+        question (str): Вопрос без вариантов ответа.
+        options (list): Пары (номер, текст варианта).
+    """
+    return ' | '.join([normalize_query(question), *sorted(normalize_option(text) for _, text in options)])
+
+
+class MinHasher:
+    """
+    Считает MinHash-сигнатуры множеств символьных триграмм.
+
+    Хеш-функции — multiply-shift: h(x) = (a * x + b) >> 32 в 64-битной арифметике
+    с переполнением, по паре (a, b) на каждую позицию сигнатуры.
+
+    Attributes:
+        num_perm (int): Длина сигнатуры.
+    """
+    def __init__(self, num_perm: int = 128, seed: int = 1):
+        self.num_perm = num_perm
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, 2 ** 64 - 1, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 2 ** 64 - 1, size=num_perm, dtype=np.uint64)
+
+    def signature(self, text: str):
+        """
+        Возвращает сигнатуру текста — массив num_perm чисел uint32.
+        """
+        text = text.ljust(_NGRAM)
+        codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+        count = len(codes) - _NGRAM + 1
+        shingles = codes[:count]
+        for offset in range(1, _NGRAM):
+            shingles = (shingles << _CODE_BITS) | codes[offset:offset + count]
+        shingles = (np.unique(shingles) * _MIX) >> _SHIFT
+        hashes = (shingles[:, None] * self._a + self._b) >> _SHIFT
+        return hashes.min(axis=0).astype(np.uint32)
+
+
+class QuestionIndex:
+    """
+    Индекс уже обработанных вопросов с их источниками и ответом.
+
+    Записи лежат в кольцевом буфере: при переполнении вытесняется самая старая.
+    Если задан store, записи пишутся в SQLite и загружаются оттуда при старте (load).
+
+    Attributes:
+        max_entries (int): Максимум записей.
+        threshold (float): Минимальная оценка сходства (коэффициента Жаккара), чтобы считать вопросы похожими.
+        ttl (float): Время жизни записи (в секундах).
+        store (SQLiteStore или None): Дисковое хранилище.
+    """
+    name = 'similar'
+
+    def __init__(self, max_entries: int, threshold: float, ttl: float, store: SQLiteStore = None, num_perm: int = 128):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl = ttl
+        self.store = store
+        self._hasher = MinHasher(num_perm)
+        self._signatures = np.zeros((max_entries, num_perm), dtype=np.uint32)
+        self._expires = np.zeros(max_entries)  # 0 — слот пуст
+        self._entries = [None] * max_entries
+        self._keys = [None] * max_entries
+        self._slots = {}  # ключ -> слот
+        self._next = 0
+        self._stats = {'hits': 0, 'misses': 0}
+
+    def find(self, question: str, options):
+        """
+        Ищет самый похожий вопрос в индексе.
+
+        Аргументы:
+            question (str): Вопрос без вариантов ответа.
+            options (list): Пары (номер, текст варианта).
+
+        Возвращает:
+            dict или None: Сохраненная запись (options, answer, reasoning, sources, main_texts)
+            с оценкой сходства в поле score или None, если похожих вопросов нет.
+        """
+        signature = self._hasher.signature(question_text(question, options))
+        scores = (self._signatures == signature).mean(axis=1)
+        scores[self._expires <= time.time()] = 0.0
+        slot = int(scores.argmax())
+        if scores[slot] < self.threshold:
+            self._stats['misses'] += 1
+            return None
+        self._stats['hits'] += 1
+        return {**self._entries[slot], 'score': float(scores[slot])}
+
+    async def add(self, question: str, options, record: dict):
+        """
+        Добавляет вопрос в индекс и, если задан store, на диск.
+
+        Аргументы:
+            question (str): Вопрос без вариантов ответа.
+            options (list): Пары (номер, текст варианта).
+            record (dict): Ответ на вопрос: answer, reasoning, sources, main_texts.
+        """
+        entry = {'question': question, 'options': [list(option) for option in options], **record}
+        text = question_text(question, options)
+        key = prompt_key(text)
+        expires_at = time.time() + self.ttl
+        self._put(key, self._hasher.signature(text), entry, expires_at)
+        if self.store is not None:
+            try:
+                payload = json.dumps(entry, ensure_ascii=False)
+                await asyncio.to_thread(self.store.set, self.name, key, payload, expires_at)
+            except sqlite3.Error as e:
+                logger.info(f'Индекс похожих вопросов: не удалось записать на диск: {e}')
+
+    async def load(self):
+        """
+        Загружает в индекс самые свежие записи с диска.
+        """
+        if self.store is None:
+            return
+        rows = await asyncio.to_thread(self.store.items, self.name, self.max_entries)
+        # от старых к новым, чтобы новые записи оказались последними в очереди на вытеснение
+        for key, payload, expires_at in reversed(rows):
+            entry = json.loads(payload)
+            text = question_text(entry['question'], entry['options'])
+            self._put(key, self._hasher.signature(text), entry, expires_at)
+        logger.info(f'Индекс похожих вопросов: загружено {len(rows)} записей')
+
+    def stats(self):
+        """
+        Возвращает число попаданий, промахов и записей в индексе.
+        """
+        return {**self._stats, 'entries': int((self._expires > time.time()).sum())}
+
+    def _put(self, key: str, signature, entry: dict, expires_at: float):
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._next
+            self._next = (self._next + 1) % self.max_entries
+            if self._keys[slot] is not None:
+                del self._slots[self._keys[slot]]
+            self._keys[slot] = key
+            self._slots[key] = slot
+        self._signatures[slot] = signature
+        self._expires[slot] = expires_at
+        self._entries[slot] = entry
+
+
+def remap_answer(entry: dict, question: str, options):
+    """
+    Переносит сохраненный ответ на новую нумерацию вариантов.
+
+    Высокое сходство сигнатур не значит, что ответ тот же: "в 2018 году" и "в 2019 году",
+    "была" и "не была" почти не меняют набор триграмм. Поэтому ответ переносится, только если
+    совпадают множество слов вопроса и варианты (с точностью до порядка и регистра);
+    иначе переиспользовать можно лишь источники.
+
+    Аргументы:
+        entry (dict): Запись индекса.
+        question (str): Вопрос без вариантов ответа.
+        options (list): Пары (номер, текст варианта) нового вопроса.
+
+    Возвращает:
+        int, str или None: Номер того же варианта в новом вопросе, 'null' для вопроса без вариантов
+        или None, если ответ перенести нельзя.
+    """
+    if question_words(entry['question']) != question_words(question):
+        return None
+    old_options = {str(number): normalize_option(text) for number, text in entry['options']}
+    new_numbers = {normalize_option(text): number for number, text in options}
+    if sorted(old_options.values()) != sorted(new_numbers):
+        return None
+    if not options:
+        return 'null'
+    return new_numbers.get(old_options.get(str(entry['answer'])))
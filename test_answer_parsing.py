@@ -0,0 +1,54 @@
+"""
+Проверка разбора вариантов и финального ответа модели для разных форматов вариантов.
+
+Запуск: python test_answer_parsing.py (или pytest test_answer_parsing.py).
+"""
+import asyncio
+import json
+
+import main
+
+OPTION_FORMATS = {
+    'dot': '1. Москва\n2. Санкт-Петербург\n3. Казань',
+    'paren': '1) Москва\n2) Санкт-Петербург\n3) Казань',
+    'dash': '1 - Москва\n2 - Санкт-Петербург\n3 - Казань',
+    'colon': '1: Москва\n2: Санкт-Петербург\n3: Казань',
+}
+
+
+def answer_with_model_reply(answers: str, reply: dict):
+    """
+    Вызывает answer_question, подменив yandex_gpt ответом модели `reply`.
+    """
+    async def fake_gpt(query, priority=main.priority_answer):
+        text = json.dumps(reply, ensure_ascii=False)
+        return {'result': {'alternatives': [{'message': {'role': 'assistant', 'text': text}}]}}
+
+    original, main.yandex_gpt = main.yandex_gpt, fake_gpt
+    try:
+        return asyncio.run(main.answer_question('Какой город является столицей России?', answers, []))
+    finally:
+        main.yandex_gpt = original
+
+def test_option_formats():
+    for name, answers in OPTION_FORMATS.items():
+        assert main.parse_option_numbers(answers) == {1, 2, 3}, name
+        assert [text for _, text in main.parse_options(answers)] == ['Москва', 'Санкт-Петербург', 'Казань'], name
+        assert answer_with_model_reply(answers, {'answer': 2, 'reasoning': 'Так.'}) == (2, 'Так.'), name
+
+def test_unparsed_options_keep_number():
+    # варианты без распознаваемых номеров: ответ все равно номер, а не 'null'
+    answers = '1 Москва\n2 Санкт-Петербург'
+    assert main.parse_option_numbers(answers) == set()
+    assert answer_with_model_reply(answers, {'answer': 2, 'reasoning': 'Так.'}) == (2, 'Так.')
+
+def test_no_options():
+    reply = {'answer': None, 'reasoning': 'Москва.'}
+    assert answer_with_model_reply('В данном вопросе нет вариантов ответа', reply) == ('null', 'Москва.')
+
+
+if __name__ == '__main__':
+    test_option_formats()
+    test_unparsed_options_keep_number()
+    test_no_options()
+    print('ok')